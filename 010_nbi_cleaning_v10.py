@@ -6,11 +6,16 @@
 
 # Import Libraries
 import os
+import codecs
 import pandas as pd
 import numpy as np
-import geopandas as gpd
 import matplotlib.pyplot as plt
 import math as m
+import mwlib as mw
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.compute as pc
+from concurrent.futures import as_completed
 
 
 # In[2]:
@@ -30,27 +35,12 @@ def get_directories(path):
                 directories.append(name)
     return directories
 
-def get_coastal_locations(path):
-    # A function that returns a list of coastal states & counties
-    coastal = pd.read_csv(path+'Coastal_Counties.csv', dtype=str)
-    states = coastal['stateusps'].unique().copy()
-    counties = coastal['countyfips'].unique().copy()
-    return states, counties
-
 def get_state_year(file):
     # This function discerns the state and year from the input file name
     state = file[0:2]
     year = file[2:4]
     return state, year
 
-def log_progress(step, state, year):
-    # A function for recording the successful completion of a step
-    # used to troubleshoot code & locate point of crash
-    with open('output/logs/log_file.csv', 'a') as file:
-        output = step + ',' + state + ',' + year + '\n'
-        file.write(output)
-    return
-
 def str_to_decimal_degrees(value):
     # A function that converts string type Lat & Long into decimal form
     degrees = value.str[:-6].astype('int64')
@@ -67,11 +57,7 @@ def dms(value):
     decimal_degrees = degrees + (minutes + seconds/60)/60
     return decimal_degrees
 
-def geometric_mean(df, rating_cols):
-    # Calculate geometric mean & return df
-    df['MEAN_RATING'] = df[rating_cols].product(axis=1) **  (1/(df[rating_cols].isnull().sum(axis=1) - 6)*-1)
-    return df
-
+@mw.timed_function()
 def fix_early_nc(df):
     # A function for updating old NC NBI structure numbers to the new format used
     #  from the year 2000 and onwards
@@ -100,32 +86,75 @@ def fix_early_nc(df):
     df.loc[mask, 'STRUCTURE_NUMBER_008'] = df.loc[mask, 'STRUCTURE_NUMBER_008'].map(rec_dict)
     return df
 
-def clean_nbi(file_name, columns_to_keep, ratings):
+def detect_encoding(file_name):
+    # A function that checks (once, in blocks) whether a file is valid UTF-8. Files that
+    #   aren't are read as latin-1, which accepts any byte
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    with open(file_name, 'rb') as file:
+        try:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                decoder.decode(block)
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            return 'latin-1'
+    return 'utf-8'
+
+@mw.timed_function()
+def read_nbi(file_name, columns_to_keep, ratings):
+    # A function that reads only the needed columns of an inventory file. Ratings are read
+    #   as categoricals of the NBI rating codes; everything else is read as strings.
+    #   Returns the DataFrame along with counts of skipped lines & unrecognized ratings
+    bad_lines = [0]
+
+    def skip_bad_line(row):
+        # Count & skip records with the wrong number of fields
+        bad_lines[0] += 1
+        return 'skip'
+
+    table = pacsv.read_csv(file_name,
+                           read_options=pacsv.ReadOptions(encoding=detect_encoding(file_name)),
+                           parse_options=pacsv.ParseOptions(invalid_row_handler=skip_bad_line),
+                           convert_options=pacsv.ConvertOptions(
+                               include_columns=columns_to_keep,
+                               column_types={col: pa.string() for col in columns_to_keep},
+                               strings_can_be_null=True))
+
+    # Trim surrounding whitespace & treat blank fields as missing
+    columns = []
+    for col in table.column_names:
+        values = pc.utf8_trim_whitespace(table[col])
+        columns.append(pc.if_else(pc.equal(values, ''), pa.scalar(None, pa.string()), values))
+    nbi = pa.table(columns, names=table.column_names).to_pandas()
+
+    # Store ratings as categoricals, unrecognized codes are treated as missing
+    bad_ratings = 0
+    for col in ratings:
+        valid = nbi[col].isin(rating_codes) | nbi[col].isnull()
+        bad_ratings += (~valid).sum()
+        nbi[col] = nbi[col].where(valid).astype(rating_dtype)
+    return nbi, bad_lines[0], int(bad_ratings)
+
+@mw.timed_function()
+def clean_nbi(file_name, columns_to_keep, ratings, state, year, coastal_counties):
     # A funciton used to clean out records with missing location data &/or bridge ratings
     
     # Read inventory file into DataFrame
-    try:
-        nbi = pd.read_csv(file_name, dtype=str, skipinitialspace=True, on_bad_lines='skip')
-    except:
-        nbi = pd.read_csv(file_name, dtype=str, skipinitialspace=True, encoding='unicode_escape',
-                          on_bad_lines='skip')
-    log_progress('clean_read', state, year)
+    nbi, bad_lines, bad_ratings = read_nbi(file_name, columns_to_keep, ratings)
+    if bad_lines or bad_ratings:
+        print('\t\t%s: skipped %d bad lines, %d unrecognized ratings' % (
+            os.path.basename(file_name), bad_lines, bad_ratings))
     
     # Create an attribute with state and county codes concatenated
     nbi['STATE_COUNTY'] = nbi['STATE_CODE_001'] + nbi['COUNTY_CODE_003']
-    log_progress('clean_state_county', state, year)
     
     # Drop bridges not located in coastal counties
     nbi = nbi[nbi.STATE_COUNTY.isin(coastal_counties)].copy()
-    log_progress('clean_drop state_county', state, year)
     
     # Drop unwanted attributes
     nbi = nbi[columns_to_keep].copy()
-    log_progress('clean_drop_cols', state, year)
     
     # Drop bridges with COUNTY_CODE_003 == nan
     nbi.dropna(subset=['COUNTY_CODE_003'], inplace = True)
-    log_progress('clean_county_code_drop', state, year)
     
     # Drop Lat & Long NaN values
     nbi = nbi[nbi['LAT_016'].str.contains('-') == False].copy()
@@ -133,79 +162,123 @@ def clean_nbi(file_name, columns_to_keep, ratings):
     nbi = nbi[nbi['LAT_016'].str.contains(r'\.') == False].copy()
     nbi = nbi[nbi['LONG_017'].str.contains(r'\.') == False].copy()
     nbi.dropna(subset=['LAT_016', 'LONG_017'], inplace=True)
-    log_progress('clean_latlong_nan_drop', state, year)
 
     # Append state name
     nbi['STATE'] = state
-    log_progress('clean_add_state_col', 'nbi', year)
 
     # Combine state & county
-    nbi['COUNTY_CODE_003'] = nbi['COUNTY_CODE_003'].apply(int).apply(str)
-    nbi['COUNTY_CODE_003'] = nbi['COUNTY_CODE_003'].apply(lambda x: x.zfill(3))
+    nbi['COUNTY_CODE_003'] = mw.pad_fips(nbi['COUNTY_CODE_003'], 3)
     nbi['ST_CNTY'] = nbi['STATE'] + nbi['COUNTY_CODE_003']
     
-    # Convert Lat & Long to integers
-    nbi['LAT_016'] = nbi['LAT_016'].astype('int64').copy()
-    nbi['LONG_017'] = nbi['LONG_017'].astype('int64').copy()
+    # Convert Lat & Long to integers (DDDMMSSss fits in 32 bits)
+    nbi['LAT_016'] = nbi['LAT_016'].astype('int32').copy()
+    nbi['LONG_017'] = nbi['LONG_017'].astype('int32').copy()
     nbi = nbi[nbi['LONG_017'] > 999999].copy()
     nbi = nbi[nbi['LAT_016'] > 999999].copy()
-    log_progress('clean_drop_bad_lat_long', state, year)
     
-    # Drop records with missing ratings
-    nbi[ratings] = nbi[ratings].replace('', np.nan).copy()
+    # Drop records with missing ratings (blank fields were read as missing)
     nbi.dropna(subset=ratings, inplace=True)
-    log_progress('clean_drop_missing_ratings', state, year)
     
     return nbi
 
-def process_nbi(nbi_to_process, ratings):
+@mw.timed_function()
+def process_nbi(nbi_to_process, ratings, year):
     # A function used to create new attributes, convert Lat & Long to decimal values,
     #   and to convert the pandas DataFrame input into a geopandas DataFrame
 
-    # Convert structure ratings of N, T, & U to 999 so they can be ignored by the min function
-    nbi_to_process[ratings] = nbi_to_process[ratings].replace('N', '999').copy()
-    nbi_to_process[ratings] = nbi_to_process[ratings].replace('n', '999').copy()
-    nbi_to_process[ratings] = nbi_to_process[ratings].replace('T', '999').copy()
-    nbi_to_process[ratings] = nbi_to_process[ratings].replace('U', '999').copy()
-    log_progress('proc_nan_replace', 'nbi', year)
-    
-    # Convert ratings to int type
-    nbi_to_process[ratings] = nbi_to_process[ratings].astype('int64')
-    log_progress('proc_ratings_to_int', 'nbi', year)
-
-    # Convert 999 to np.nan
-    nbi_to_process[ratings] = nbi_to_process[ratings].replace(999, np.nan).copy()
-
-    # Count number of non-null values
-    nbi_to_process['NUM_RATINGS'] = (nbi_to_process[ratings].isnull().sum(axis=1) - 6)*-1
-
-    # Calculate geometric mean prodct(n_ratings)^(1/n)
-    #nbi_to_process['MEAN_RATING'] = nbi_to_process[ratings].product(axis=1) **  (1/(nbi_to_process[ratings].isnull().sum(axis=1) - 6)*-1)
-    nbi_to_process = geometric_mean(nbi_to_process, ratings)
-    
-    # Calculate LOWEST_RATING attribute as culvert condition on minimum bridge condition
-    nbi_to_process['LOWEST_RATING'] = nbi_to_process[ratings].min(axis=1)
-    log_progress('proc_min_lowest_rating_axis=1', 'nbi', year)
+    # Look up the value of every rating in one pass over the category codes of all the
+    #   rating columns, with N, T, & U (& missing) as the rating_na sentinel
+    codes = np.column_stack([nbi_to_process[col].cat.codes.to_numpy() for col in ratings])
+    values = rating_values[codes]
+    rated = values != rating_na
+
+    # Store ratings as nullable Int8 (one byte & a mask instead of an 8 byte float)
+    for i, col in enumerate(ratings):
+        nbi_to_process[col] = pd.arrays.IntegerArray(values[:, i].astype('int8'), ~rated[:, i])
+
+    # Count the ratings of each bridge, their geometric mean (n-th root of the product of
+    #   n ratings) & the lowest, in one pass over the rating array
+    summary = mw.rating_summary(values, rated)
+    nbi_to_process['NUM_RATINGS'] = summary['count'].to_numpy().astype('uint8')
+    nbi_to_process['MEAN_RATING'] = summary['geometric_mean'].to_numpy()
+
+    # Calculate LOWEST_RATING attribute as culvert condition on minimum bridge condition,
+    #   bridges with no ratings are dropped
+    nbi_to_process['LOWEST_RATING'] = summary['lowest'].to_numpy()
     nbi_to_process = nbi_to_process[nbi_to_process.LOWEST_RATING <= 9].copy()
-    log_progress('proc_min_lowest_rating<=9', 'nbi', year)
+    nbi_to_process['LOWEST_RATING'] = nbi_to_process['LOWEST_RATING'].astype('uint8')
+
+    # Store year built as a number so later stages don't have to convert it
+    nbi_to_process['YEAR_BUILT_027'] = pd.to_numeric(nbi_to_process['YEAR_BUILT_027'],
+                                                     errors='coerce').astype('Int16')
 
     # Create Lat & Long in decimal format
     nbi_to_process['LAT_DEC'] = dms(nbi_to_process['LAT_016'])
     nbi_to_process['LONG_DEC'] = dms(nbi_to_process['LONG_017'])
     nbi_to_process['LONG_DEC'] = nbi_to_process['LONG_DEC']*(-1)
-    log_progress('proc_str_to_dec_LAT', 'nbi', year)
 
     # Create a unique identifier for each bridge (assumes structure number may not
     #   be unique from state to state)
     nbi_to_process['STATE_STR'] = nbi_to_process['STATE_CODE_001'] + nbi_to_process['STRUCTURE_NUMBER_008']
-    log_progress('proc_state_struct', 'nbi', year)
+
+    # Store the codes shared by many bridges as categoricals
+    for col in code_cols:
+        nbi_to_process[col] = nbi_to_process[col].astype('category')
 
     # Convert nbi_time_series to geopandas DataFrame
-    processed_nbi = gpd.GeoDataFrame(nbi_to_process, geometry = gpd.points_from_xy(
-        nbi_to_process.LONG_DEC, nbi_to_process.LAT_DEC, crs='epsg:4326'))
-    log_progress('proc_gpd', 'nbi', year)
+    processed_nbi = mw.bridge_points(nbi_to_process)
     return processed_nbi
 
+@mw.timed_function(flush='010')
+def clean_state_file(file_name, state, year):
+    # A function that cleans a single state inventory file; each file is independent
+    #   so this can run in a worker process. Its step timings are written once it's done
+    next_nbi = clean_nbi(file_name, keep_columns, rating_cols, state, year, coastal_counties)
+
+    if state == 'NC' and int(year) >= 25:
+        # call fix_early_nc
+        next_nbi = fix_early_nc(next_nbi)
+    return next_nbi
+
+def write_year(directory, state_frames):
+    # A function that combines the cleaned state files for one year, processes them,
+    #   and writes the yearly output file
+    year = directory[2:4]
+
+    with mw.timed('write_year', '', year) as step:
+        # Combine all states in a single concat (in file order so output is deterministic)
+        with mw.timed('concat'):
+            if state_frames:
+                nbi_time_series = pd.concat(state_frames)
+            else:
+                nbi_time_series = pd.DataFrame(columns = keep_columns).astype(
+                    {col: rating_dtype for col in rating_cols})
+
+        # Process nbi_time_series, reporting the memory the year takes before & after
+        cleaned_mb = mw.frame_mb(nbi_time_series)
+        nbi_time_series = process_nbi(nbi_time_series, rating_cols, year)
+        print('\t\t%s: %d bridges, %.1f MB cleaned, %.1f MB processed' % (
+            directory[:4], len(nbi_time_series), cleaned_mb, mw.frame_mb(nbi_time_series)))
+
+        # WRITE DATAFRAME TO TABLE (GeoParquet by default)
+        mw.write_table(nbi_time_series, output_path+'out' + directory[:4])
+
+        # Write a spatial index of the bridge locations next to the table
+        with mw.timed('point_index', rows_in=len(nbi_time_series)):
+            mw.save_point_index(mw.build_point_index(nbi_time_series['LONG_DEC'], nbi_time_series['LAT_DEC']),
+                                output_path+'out' + directory[:4])
+        step['rows_out'] = len(nbi_time_series)
+
+    # Write this year's step timings in one go
+    mw.flush_timings('010')
+    return
+
+def build_year(directory, tasks):
+    # A function that cleans every coastal state file of a year, then processes & writes
+    #   the year. Runs as one task in a worker so the year's frames never leave it
+    write_year(directory, [clean_state_file(*task) for task in tasks])
+    return directory
+
 
 # In[3]:
 
@@ -228,6 +301,20 @@ keep_columns = ['STATE_CODE_001',           #0
 rating_cols = ['DECK_COND_058', 'SUPERSTRUCTURE_COND_059', 'SUBSTRUCTURE_COND_060',
                'CHANNEL_COND_061', 'CULVERT_COND_062', 'SCOUR_CRITICAL_113']
 
+# Codes that may appear in the rating columns (N = not applicable, T & U = tidal/unknown
+#   scour), stored as a categorical so every state file shares the same categories
+rating_codes = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'N', 'n', 'T', 'U']
+rating_dtype = pd.CategoricalDtype(rating_codes)
+
+# Value of each rating code, with N, T, & U (not rated) as a sentinel above every rating.
+#   The extra last entry is looked up by missing ratings (category code -1)
+rating_na = 255
+rating_values = np.array([rating_na if code in ['N', 'n', 'T', 'U'] else int(code)
+                          for code in rating_codes] + [rating_na], dtype='uint8')
+
+# Columns of codes repeated across many bridges, stored as categoricals
+code_cols = ['STATE_CODE_001', 'COUNTY_CODE_003', 'STATE', 'ST_CNTY']
+
 
 # In[4]:
 
@@ -238,51 +325,81 @@ rating_cols = ['DECK_COND_058', 'SUPERSTRUCTURE_COND_059', 'SUBSTRUCTURE_COND_06
 input_path = 'input/nbi_files/'
 output_path = 'output/nbi_clean/'
 
+# Number of worker processes (1 = serial)
+n_workers = mw.WORKERS
+
 # Retrieve lists of coastal states and coastal counties
-coastal_states, coastal_counties = get_coastal_locations('input/')
+coastal = mw.coastal_locations()
+coastal_states, coastal_counties = coastal['states'], coastal['counties']
 
 # Get a list of directories
 list_of_dirs = get_directories(input_path)
 
-# Status
-print('Working on:')
-
+# Build a list of coastal state files to clean for each year directory
+file_tasks = {}
 for directory in sorted(list_of_dirs):
-    # Create an empty DataFrame to store aggregate inventory data
-    nbi_time_series = pd.DataFrame(columns = keep_columns)
 
-    # Print current year
-    print('\t'+directory[:4])
-    
     # Get a list of files in the current directory to process
     list_of_files = get_files(input_path+directory, '.txt')
 
-    # Loop through all state NBI files in directory
+    file_tasks[directory] = []
     for current_file in sorted(list_of_files):
 
         # Determine state & year for the current file
         state, year = get_state_year(current_file)
 
-        # If the current file is a coastal state, aggregate it
+        # If the current file is a coastal state, queue it for cleaning
         if state in coastal_states:
-            log_progress('start_state_loop', 'next_nbi', year)
-            # Clean current file
-            next_nbi = clean_nbi(input_path+directory+'/'+current_file, keep_columns, rating_cols)
-            log_progress('clean_nbi', 'next_nbi', year)
-
-            if state == 'NC' and int(year) >= 25:
-                # call fix_early_nc
-                next_nbi = fix_early_nc(next_nbi)
-            
-            # Append current data to nbi_time_series dataframe
-            nbi_time_series = pd.concat([nbi_time_series, next_nbi])
-            log_progress('concat', 'next_nbi', year)
-    
-    # Process nbi_time_series
-    nbi_time_series = process_nbi(nbi_time_series, rating_cols)
+            file_tasks[directory].append((input_path+directory+'/'+current_file, state, year))
+
+# Only rebuild years whose input files or processing logic changed since the last run
+manifest = mw.load_manifest('010')
+code = mw.code_version(__file__)
 
-    # WRITE DATAFRAME TO CSV
-    nbi_time_series.to_csv(output_path+'out' + directory[:4] + '.csv', index=False)
+def year_inputs(directory):
+    # The coastal state files for a year plus the coastal county list
+    return [task[0] for task in file_tasks[directory]] + ['input/Coastal_Counties.csv']
 
-print('Finished')    
+def year_outputs(directory):
+    return [mw.table_path(output_path+'out' + directory[:4]),
+            mw.point_index_path(output_path+'out' + directory[:4])]
 
+stale_dirs = []
+for directory in sorted(file_tasks):
+    if mw.is_current(manifest, directory, year_inputs(directory), year_outputs(directory), code):
+        print('\t'+directory[:4]+' up to date')
+    else:
+        stale_dirs.append(directory)
+
+# Status
+print('Working on:')
+mw.reset_timings('010')
+
+if n_workers > 1:
+    with mw.process_pool(n_workers) as pool:
+        # Build each year in its own worker, so only as many years as workers are in
+        #   memory at once
+        futures = []
+        for directory in stale_dirs:
+            print('\t'+directory[:4])
+            futures.append(pool.submit(build_year, directory, file_tasks[directory]))
+
+        # Surface any errors raised while building a year & record finished years
+        for future in as_completed(futures):
+            directory = future.result()
+            mw.record(manifest, directory, year_inputs(directory), year_outputs(directory), code)
+            mw.save_manifest('010', manifest)
+else:
+    for directory in stale_dirs:
+        # Print current year
+        print('\t'+directory[:4])
+
+        # Clean all state NBI files in directory, then process & write the year
+        build_year(directory, file_tasks[directory])
+        mw.record(manifest, directory, year_inputs(directory), year_outputs(directory), code)
+        mw.save_manifest('010', manifest)
+
+# Report the slowest steps of this run
+mw.timing_report(['010'])
+
+print('Finished')
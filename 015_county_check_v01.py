@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# In[1]:
+
+
+import os
+import sys
+import time
+import pandas as pd
+import geopandas as gpd
+import mwlib as mw
+
+
+# In[2]:
+
+
+# Set folder paths
+input_path = 'output/nbi_clean/'
+output_path = 'output/county_check/'
+
+# County boundaries to check bridge locations against (e.g. the Census cartographic
+#  boundary file cb_2023_us_county_500k, any format geopandas reads). Set
+#  CB_COUNTY_BOUNDARIES to use another file; the stage is skipped if there is none
+boundary_file = os.environ.get('CB_COUNTY_BOUNDARIES', 'input/cb_us_county_500k.shp')
+
+# Number of bridge records to join at a time
+chunk_rows = 200000
+
+if not os.path.exists(boundary_file):
+    print('No county boundary file (' + boundary_file + '), skipping county check')
+    sys.exit()
+
+list_of_files = mw.list_tables(input_path)
+
+# Skip this stage if its inputs & logic haven't changed since the last run
+stage_inputs = [mw.table_path(input_path+file) for file in list_of_files] + [boundary_file]
+stage_outputs = [mw.table_path(output_path+'county_mismatches'),
+                 mw.table_path(output_path+'county_check_summary')]
+if mw.stage_is_current('015', stage_inputs, stage_outputs, __file__):
+    print('County check up to date')
+    sys.exit()
+
+# Time the steps of this run
+mw.reset_timings('015')
+
+
+# In[3]:
+
+
+# Functions
+@mw.timed_function()
+def get_counties(file):
+    # A function that reads the county boundaries & keys each county by ST_CNTY (state
+    #  abbreviation & county fips), the same key the cleaned bridges carry
+    counties = gpd.read_file(file, columns=['STATEFP', 'COUNTYFP'])
+    counties = counties.to_crs('epsg:4326')
+    state_codes = mw.coastal_locations()['state_codes']
+    counties['COUNTY_FOUND'] = mw.fips_key(mw.state_abbreviations(counties['STATEFP'], state_codes),
+                                           counties['COUNTYFP'])
+    return counties[['COUNTY_FOUND', 'geometry']]
+
+@mw.timed_function()
+def check_chunk(bridges, counties):
+    # A function that finds the county each bridge's coordinates fall in (one indexed
+    #  spatial join per chunk) & returns the bridges whose coded county differs
+    points = mw.bridge_points(bridges)
+    joined = gpd.sjoin(points, counties, how='left', predicate='intersects')
+
+    # A point on a shared boundary matches both counties, keep the coded one if it's there
+    joined['MATCH'] = joined['COUNTY_FOUND'] == joined['ST_CNTY']
+    joined = joined.sort_values('MATCH', ascending=False, kind='stable')
+    joined = joined[~joined.index.duplicated(keep='first')].sort_index()
+    return pd.DataFrame(joined.loc[~joined['MATCH'], bridges.columns.tolist() + ['COUNTY_FOUND']])
+
+
+# In[4]:
+
+
+print('Checking bridge locations against county boundaries...')
+
+counties = get_counties(boundary_file)
+columns = ['STATE_STR', 'ST_CNTY', 'LONG_DEC', 'LAT_DEC']
+
+mismatches = []
+summary = []
+start = time.perf_counter()
+for file in list_of_files:
+    year = file[-4:]
+    checked = 0
+    found = 0
+    for chunk in mw.iter_table(input_path+file, columns, chunk_rows):
+        chunk = chunk.reset_index(drop=True)
+        chunk.insert(0, 'YEAR', year)
+        bad = check_chunk(chunk, counties)
+        checked += len(chunk)
+        found += len(bad)
+        mismatches.append(bad)
+    summary.append({'YEAR': year, 'BRIDGES': checked, 'MISMATCHES': found,
+                    'PCT_MISMATCHED': 100 * found / checked if checked else 0.0})
+    print('\t%s: %d of %d bridges outside their coded county' % (year, found, checked))
+seconds = time.perf_counter() - start
+
+summary = pd.DataFrame(summary, columns=['YEAR', 'BRIDGES', 'MISMATCHES', 'PCT_MISMATCHED'])
+total = summary['BRIDGES'].sum()
+print('Checked %d bridge records in %.1f s (%.0f records/s)' % (total, seconds, total / max(seconds, 1e-9)))
+
+
+# In[5]:
+
+
+# Write the mismatched records & the yearly summary
+os.makedirs(output_path, exist_ok = True)
+mismatches = pd.concat(mismatches, ignore_index=True) if mismatches else pd.DataFrame(columns=['YEAR'] + columns + ['COUNTY_FOUND'])
+mw.write_table(mismatches, output_path+'county_mismatches')
+mw.write_table(summary, output_path+'county_check_summary')
+
+# Write the step timings & record this run in the stage manifest
+mw.flush_timings('015')
+mw.record_stage('015', stage_inputs, stage_outputs, __file__)
+
+print('Finished')
@@ -5,48 +5,18 @@
 
 
 # Import Libraries
-import os
+import sys
 import pandas as pd
 import numpy as np
-import geopandas as gpd
-from shapely import wkt
+import warnings
+import mwlib as mw
 
 
 # In[2]:
 
 
-# Functions for reading & cleaning inventory files
-def get_files(directory, ext):
-    # A function that returns a list of files in the specified directory
-    files = [i for i in os.listdir(directory) if ext in i]
-    return files
-
-def init_time_ser(folder, files):
-    # Create time series dataframe
-
-    # List of columns to have in final output
-    cols = ['STATE_STR',
-            'geometry',
-            'ST_CNTY'
-           ]
-
-    # Initialize DataFrame
-    time_df = pd.DataFrame(columns = ['STATE_STR'])
-
-    for file in sorted(files, reverse = True):
-        next_df = pd.read_csv(folder+file)
-        next_df = next_df[cols].copy()
-        time_df = pd.concat([time_df, next_df]).copy()
-        time_df = time_df[~time_df.index.duplicated(keep='first')]
-    return time_df
-
-
-# In[3]:
-
-
-# Get list of files to process
-input_directory = 'output/nbi_clean/'
-list_of_files = get_files(input_directory,'.csv')
+# Bridge x year x attribute cube written by 030
+cube_path = 'output/time_series/bridge_cube'
 
 # Directory to write output to
 output_directory = 'output/structure_age/'
@@ -54,47 +24,47 @@ output_directory = 'output/structure_age/'
 # Directory to write GIS Shape files
 gis_directory = 'output/shape_files/'
 
+# Skip this stage if its inputs & logic haven't changed since the last run
+stage_inputs = mw.cube_files(cube_path)
+stage_outputs = [mw.table_path(output_directory+'structure_ages'),
+                 mw.table_path(output_directory+'ages_by_county'),
+                 mw.spatial_path(gis_directory+'bridge_ages')]
+if mw.stage_is_current('020', stage_inputs, stage_outputs, __file__):
+    print('Structure ages up to date')
+    sys.exit()
 
-# In[4]:
+# Time the steps of this run
+mw.reset_timings('020')
 
 
-# Initialize time series with bridge ID and geometry data
-time_ser_initial = init_time_ser(input_directory, list_of_files)
-
-
-# In[5]:
-
+# In[3]:
 
-print('Working on:')
 
-# Initialize time_ser for the next attribute
-time_ser = time_ser_initial.copy()
+print('Reading bridge cube...')
 
-# Loop through each bridge rating attribute
-for file in sorted(list_of_files, reverse = False):
+# Bridge ID & coordinates from the cube index, year built for every year from the cube
+cube = mw.open_cube(cube_path, ['STATE_STR', 'LONG_DEC', 'LAT_DEC', 'ST_CNTY'])
+year_built, years = mw.cube_slice(cube, 'YEAR_BUILT_027')
 
-    # Get the year from the file name
-    year = file[-8:-4]
 
-    print('\t'+year)
+# In[4]:
 
-    cols = ['STATE_STR', 'YEAR_BUILT_027']
-    
-    # read in the next file
-    next_df = pd.read_csv(input_directory+file)
 
-    # trim DataFrame down to desired columns
-    next_df = next_df[cols].copy()
+print('Calculating structure ages...')
 
-    # Rename current attribute column as current year
-    next_df.rename(columns = {'YEAR_BUILT_027':str(year)}, inplace=True)
-    
-    # Merge next_df into time series
-    time_ser = time_ser.merge(next_df, on=['STATE_STR'], how = 'left').copy()
+# Earliest year built reported for each bridge across all years
+with warnings.catch_warnings():
+    # Bridges without a year built in any year are left NaN
+    warnings.simplefilter('ignore', RuntimeWarning)
+    min_built = np.nanmin(year_built, axis=1)
 
-time_ser['MIN_YR_BUILT'] = time_ser.iloc[:,3:].min(axis=1)
+time_ser = cube['index'].copy()
+time_ser['MIN_YR_BUILT'] = pd.array(min_built, dtype='Float32').astype('Int16')
 time_ser['AGE'] = 2024-time_ser.MIN_YR_BUILT
 
+# Build each bridge's point from its coordinates
+time_ser = mw.bridge_points(time_ser)
+
 # Prepare data for exporting to shape file
 keep_cols = ['STATE_STR',
              'geometry',
@@ -114,23 +84,21 @@ median_ages_county.rename(columns = {'AGE':'MED_AGE'}, inplace=True)
 
 age_stats = pd.merge(avg_ages_county, median_ages_county, on='ST_CNTY')
 
-# Covert string type geometry column back into geometry type fro GeoPandas
-time_ser['geometry'] = time_ser['geometry'].apply(wkt.loads)
-
-# Convert dataframe to a GeoPandas dataframe
-time_ser = gpd.GeoDataFrame(time_ser, crs='epsg:4326')
+print('\twriting GIS & table output')
 
-print('\twriting shapefile & csv output')
+# Export df to a GIS file (GeoPackage by default, see CB_SPATIAL_FORMAT)
+mw.write_spatial(time_ser, gis_directory+'bridge_ages')
 
-# Export df to a GeoPandas shapefile
-time_ser.to_file(gis_directory+'bridge_ages.shp')
+# Write time series to a table
+mw.write_table(time_ser, output_directory+'structure_ages')
 
-# Write time series to a csv file
-time_ser.to_csv(output_directory+'structure_ages.csv', index=False)
-
-# Write mean & median ages to csv
-age_stats.to_csv(output_directory+'ages_by_county.csv', index=False)
+# Write mean & median ages to a table
+mw.write_table(age_stats, output_directory+'ages_by_county')
 #median_ages_county.to_csv(output_directory+'median_county_ages.csv', index=True)
 
+# Write the step timings & record this run in the stage manifest
+mw.flush_timings('020')
+mw.record_stage('020', stage_inputs, stage_outputs, __file__)
+
 print('Finished')
 
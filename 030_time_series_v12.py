@@ -6,36 +6,38 @@
 
 # Import Libraries
 import pandas as pd
-import geopandas as gpd
-from shapely import wkt
+import numpy as np
 import mwlib as mw
-import os
+import sys
 
 
 # In[2]:
 
 
-def init_time_ser(folder, files):
-    # Create time series dataframe
+def init_time_ser(yearly):
+    # Create time series dataframe from the long-format yearly records
 
     # List of columns to have in final output
     cols = ['STATE_STR',
-            'geometry',
+            'LONG_DEC',
+            'LAT_DEC',
             'ST_CNTY',
            ]
 
-    # Initialize DataFrame
-    time_df = pd.DataFrame(columns = ['STATE_STR'])
-
-    for file in sorted(files, reverse = True):
-        next_df = pd.read_csv(folder+file)
-        next_df = next_df[cols].copy()
-        time_df = pd.concat([time_df, next_df]).copy()
-        time_df = time_df[~time_df.index.duplicated(keep='first')]
+    # Take records from the newest year first
+    time_df = yearly.sort_values('YEAR', ascending = False, kind = 'stable')[cols]
+    time_df = time_df[~time_df.index.duplicated(keep='first')]
     return time_df
 
-def get_years(directory, ext):
-    list_of_years = [i[-8:-4] for i in os.listdir(directory) if ext in i]
+def init_bridges(yearly):
+    # Create the bridge index of the cube: one row per bridge (STATE_STR), with the
+    #   coordinates & county of its newest record
+    cols = ['STATE_STR', 'LONG_DEC', 'LAT_DEC', 'ST_CNTY']
+    bridges = yearly.sort_values('YEAR', ascending = False, kind = 'stable')[cols]
+    return bridges.drop_duplicates('STATE_STR', keep='first').reset_index(drop=True)
+
+def get_years(directory):
+    list_of_years = [i[-4:] for i in mw.list_tables(directory)]
     return list_of_years
 
 
@@ -44,22 +46,51 @@ def get_years(directory, ext):
 
 # Get list of files to process
 input_directory = 'output/nbi_clean/'
-list_of_files = mw.get_files(input_directory,'.csv')
+list_of_files = mw.list_tables(input_directory)
 
 # Directory to write output to
 output_directory = 'output/time_series/'
 
+# Attributes to build time series for & the file each is written to
+attributes = ['MEAN_RATING', 'LOWEST_RATING',
+              'DECK_COND_058', 'SUPERSTRUCTURE_COND_059', 'SUBSTRUCTURE_COND_060',
+              'CHANNEL_COND_061', 'CULVERT_COND_062', 'SCOUR_CRITICAL_113']
+output_files = {attribute: attribute.lower() + '_time_series' for attribute in attributes}
+output_files['MEAN_RATING'] = 'rating_time_series'
+
+# Every bridge, year & attribute (the time series attributes plus year built) is also
+#  written to a memory-mapped cube that later stages slice instead of reading tables
+cube_path = output_directory+'bridge_cube'
+cube_attributes = attributes + ['YEAR_BUILT_027']
+
+# Skip this stage if its inputs & logic haven't changed since the last run
+stage_inputs = [mw.table_path(input_directory+file) for file in list_of_files]
+stage_outputs = ([mw.table_path(output_directory+output_files[attribute]) for attribute in attributes] +
+                 mw.cube_files(cube_path))
+if mw.stage_is_current('030', stage_inputs, stage_outputs, __file__):
+    print('Time series up to date')
+    sys.exit()
+
+# Time the steps of this run
+mw.reset_timings('030')
+
 
 # In[4]:
 
 
-# Initialize time series with bridge ID and geometry data
-time_ser_initial = init_time_ser(input_directory, list_of_files)
+print('Reading yearly files...')
 
-# Create a list of each year's worth of data in the output directory 
-years = get_years(input_directory, '.csv')
+# Read bridge ID, coordinates & every attribute from all years in one long-format pass
+yearly = mw.read_yearly(input_directory, ['STATE_STR', 'LONG_DEC', 'LAT_DEC', 'ST_CNTY'] + cube_attributes)
 
-structure_ages = pd.read_csv('output/structure_age/structure_ages.csv', index_col=False)
+# Initialize time series with bridge ID and geometry data (built from the coordinates).
+#  The time series tables keep their original rows (one per row number of the yearly
+#  files), while the cube has one row per bridge
+time_ser_initial = mw.bridge_points(init_time_ser(yearly))[['STATE_STR', 'geometry', 'ST_CNTY']]
+bridges = init_bridges(yearly)
+
+# Create a list of each year's worth of data in the output directory 
+years = get_years(input_directory)
 
 
 # In[5]:
@@ -67,46 +98,41 @@ structure_ages = pd.read_csv('output/structure_age/structure_ages.csv', index_co
 
 print('Processing time series...')
 
-attribute = 'MEAN_RATING'
-
-# List of columns to keep
-cols = ['STATE_STR', attribute]
+years = sorted(years)
 
-# Initialize time_ser for the next attribute
-time_ser = time_ser_initial.copy()
-    
-# Loop through each out19XX.csv/out20XX.csv
-for file in sorted(list_of_files, reverse = False):
-        
-    # Get the year from the file name
-    year = file[-8:-4]
+# Start the cube with a row for each bridge
+cube = mw.create_cube(cube_path, bridges, years, cube_attributes)
 
-    print('\t'+year)
-    
-    # read in the next file
-    next_df = pd.read_csv(input_directory+file)
+for i, attribute in enumerate(cube_attributes):
 
-    # trim DataFrame down to desired columns
-    next_df = next_df[cols].copy()
+    print('\t'+attribute)
 
-    # Rename current attribute column as current year
-    next_df.rename(columns = {attribute:str(year)}, inplace=True)
-        
-    # Remove duplicate records, keeping the first one
-    next_df = next_df[~next_df.index.duplicated(keep='first')]
+    # Pivot the attribute to one column per year & store the yearly values (before
+    #  filling forward) in the cube, in the order of its bridge index
+    wide = mw.pivot_years(yearly, attribute, years)
+    cube[i] = wide.set_index('STATE_STR').reindex(bridges['STATE_STR'])[years].to_numpy(
+        dtype='float64', na_value=np.nan)
+    if attribute not in output_files:
+        continue
 
-    # Merge next_df into time series
-    time_ser = pd.merge(time_ser, next_df, how = 'left', on = ['STATE_STR'])
+    # Merge into the time series
+    time_ser = pd.merge(time_ser_initial, wide, how = 'left', on = ['STATE_STR'])
 
     # Drop all records with 999 (NaN) values
-    drop_bridges = time_ser[(time_ser[year] == 999)].index 
-    time_ser.drop(drop_bridges, inplace = True)
+    time_ser = time_ser[~(time_ser[years] == 999).any(axis = 1)]
 
-# Remove duplicate entries
-time_ser = time_ser[~time_ser.index.duplicated(keep='first')]
+    # Remove duplicate entries
+    time_ser = time_ser[~time_ser.index.duplicated(keep='first')]
 
-# Forward Fill missing data
-time_ser[sorted(years)] = time_ser[sorted(years)].ffill(axis = 1).copy()
+    # Forward Fill missing data
+    time_ser[years] = time_ser[years].ffill(axis = 1).copy()
+
+    # Write time series to a table
+    mw.write_table(time_ser, output_directory+output_files[attribute])
+
+# Finish writing the cube
+cube.flush()
+del cube
 
 # Merge structure age & FC_ZONE
 #time_ser = pd.merge(time_ser, structure_ages['AGE'],
@@ -116,9 +142,10 @@ time_ser[sorted(years)] = time_ser[sorted(years)].ffill(axis = 1).copy()
 #time_ser.insert(3, 'FC_ZONE', time_ser.pop('FC_ZONE'))
 #time_ser.insert(4, 'ZN_TYPE', time_ser.pop('ZN_TYPE'))
 #time_ser.insert(5, 'AGE', time_ser.pop('AGE'))
-    
-# Write time series to a csv file
-time_ser.to_csv(output_directory+'rating_time_series.csv', index=False)
+
+# Write the step timings & record this run in the stage manifest
+mw.flush_timings('030')
+mw.record_stage('030', stage_inputs, stage_outputs, __file__)
 
 print('Finished')
 
@@ -5,19 +5,31 @@
 
 
 import os
+import sys
 import pandas as pd
 import numpy as np
 import scipy.stats as stats
 import statsmodels.api as sm
+import mwlib as mw
 
 
 # In[2]:
 
 
 # Set folder paths
-input_path = 'output/time_series/'
+cube_path = 'output/time_series/bridge_cube'
 output_path = 'output/county_groups/'
 
+# Skip this stage if its inputs & logic haven't changed since the last run
+stage_inputs = mw.cube_files(cube_path)
+stage_outputs = [mw.table_path(output_path+'avg_county_rating')]
+if mw.stage_is_current('040', stage_inputs, stage_outputs, __file__):
+    print('County ratings up to date')
+    sys.exit()
+
+# Time the steps of this run
+mw.reset_timings('040')
+
 
 # In[3]:
 
@@ -30,6 +42,7 @@ def get_files(directory, ext):
 
 def get_slope(y_values, years):
     # A function that returns the slope of a line of best fit through the storm frequency data
+    #   (statsmodels reference for mw.ols_trend, used when CB_VALIDATE=1)
     
     # create a dataframe of input data
     df_dict = {'year': years, 'y_values': y_values}
@@ -53,32 +66,44 @@ def get_slope(y_values, years):
 # In[4]:
 
 
-# Create list of files
-list_of_files = get_files(input_path, '.csv')
-
+print('Calculating rate of bridge rating change by county...')
 
-# In[5]:
+# Slice the bridge ratings & their counties out of the bridge cube. Trends start with the
+#  fourth year, as when they were read from the time series table's columns [6:]
+cube = mw.open_cube(cube_path, ['ST_CNTY'])
+ratings, years_str = mw.cube_slice(cube, 'MEAN_RATING')
 
+# Carry each bridge's last rating forward through years it wasn't reported
+time_series = pd.DataFrame(ratings.astype('float64'), columns=years_str).ffill(axis=1)
+years_str = years_str[3:]
+time_series = time_series[years_str]
+time_series.insert(0, 'ST_CNTY', cube['index']['ST_CNTY'].to_numpy())
 
-print('Calculating rate of bridge rating change by county...')
-
-# Load delta series & count number of records
-time_series = pd.read_csv(input_path+'rating_time_series.csv')
-    
-years_str = time_series.columns[6:]
 years = list(map(int, years_str))
 
 # calculate average bridge rating of current br_component by county
 county_avg = time_series.groupby('ST_CNTY')[years_str].mean()
 
-slope = []
-for index, row in county_avg.iterrows():
-   values = row.values.tolist()
-   slope.append(get_slope(values, years))
+# Fit a line through every county's yearly averages at once
+trend = mw.ols_trend(county_avg[years_str].to_numpy(), years)
+
+if mw.VALIDATE:
+    # Compare with a statsmodels fit of each county that has enough years to fit
+    fit = (trend['n'] >= 2).to_numpy()
+    reference = [get_slope(row.tolist(), years) for row in county_avg[years_str].to_numpy()[fit]]
+    print('\tmax slope difference from statsmodels: %.3g' %
+          np.max(np.abs(trend['slope'].to_numpy()[fit] - reference), initial=0))
+
+county_avg.insert(0, 'BR_RATE', trend['slope'].to_numpy())
+county_avg.insert(1, 'BR_INTERCEPT', trend['intercept'].to_numpy())
+county_avg.insert(2, 'BR_STD_ERR', trend['std_err'].to_numpy())
+county_avg.insert(3, 'BR_R2', trend['r_squared'].to_numpy())
 
-county_avg.insert(0, 'BR_RATE', slope)
+mw.write_table(county_avg.reset_index(), output_path+'avg_county_rating')
 
-county_avg.to_csv(output_path+'avg_county_rating.csv')
+# Write the step timings & record this run in the stage manifest
+mw.flush_timings('040')
+mw.record_stage('040', stage_inputs, stage_outputs, __file__)
 
 print('Finished')
 
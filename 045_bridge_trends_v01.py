@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# In[1]:
+
+
+import sys
+import pandas as pd
+import numpy as np
+import mwlib as mw
+
+
+# In[2]:
+
+
+# Set folder paths
+cube_path = 'output/time_series/bridge_cube'
+bridge_path = 'output/time_series/'
+county_path = 'output/county_groups/'
+
+# Number of bridges to process at a time
+chunk_rows = 100000
+
+# Skip this stage if its inputs & logic haven't changed since the last run
+stage_inputs = mw.cube_files(cube_path)
+stage_outputs = [mw.table_path(bridge_path+'bridge_trends'),
+                 mw.table_path(county_path+'county_bridge_trends')]
+if mw.stage_is_current('045', stage_inputs, stage_outputs, __file__):
+    print('Bridge trends up to date')
+    sys.exit()
+
+# Time the steps of this run
+mw.reset_timings('045')
+
+
+# In[3]:
+
+
+# Functions
+def last_rating(values):
+    # A function that returns the last non-null rating in each row
+    filled = pd.DataFrame(values).ffill(axis=1).to_numpy()
+    return filled[:, -1]
+
+def years_since_drop(values, years):
+    # A function that returns the number of years between each bridge's most recent drop
+    #   in rating & its last rating (NaN if the rating never dropped). A drop is a reported
+    #   rating below the last one reported before it, across any unreported years
+    years = np.asarray(years)
+    previous = pd.DataFrame(values).ffill(axis=1).to_numpy()
+    drops = values[:, 1:] < previous[:, :-1]
+    latest_drop = np.where(drops, years[1:], -1).max(axis=1)
+    last_year = np.where(~np.isnan(values), years, -1).max(axis=1)
+    return np.where(latest_drop >= 0, last_year - latest_drop, np.nan)
+
+def bridge_trends(index, values, years):
+    # A function that calculates the deterioration trend of every bridge in a chunk from
+    #   the years each bridge was reported in (no values filled forward)
+    values = values.astype('float64')
+    trend = mw.ols_trend(values, years)
+    return pd.DataFrame({'STATE_STR': index['STATE_STR'].to_numpy(),
+                         'ST_CNTY': index['ST_CNTY'].to_numpy(),
+                         'BR_SLOPE': trend['slope'].to_numpy(),
+                         'BR_SLOPE_SE': trend['std_err'].to_numpy(),
+                         'NUM_YEARS': trend['n'].to_numpy(),
+                         'LAST_RATING': last_rating(values),
+                         'YRS_SINCE_DROP': years_since_drop(values, years)})
+
+
+# In[4]:
+
+
+print('Calculating bridge rating trends...')
+
+# Bridge IDs, counties & years of the bridge cube
+cube = mw.open_cube(cube_path, ['STATE_STR', 'ST_CNTY'])
+years = list(map(int, cube['years']))
+
+# Slice the reported bridge ratings out of the cube in chunks of bridges, keeping only
+#   the per-bridge results
+trends = []
+for start in range(0, len(cube['index']), chunk_rows):
+    bridges = slice(start, start + chunk_rows)
+    values, _ = mw.cube_slice(cube, 'MEAN_RATING', bridges=bridges)
+    trends.append(bridge_trends(cube['index'][bridges], values, years))
+    print('\t%d bridges' % sum(len(t) for t in trends))
+trends = pd.concat(trends, ignore_index=True)
+
+# Declining bridges (NaN where a bridge has too few reported years for a slope)
+trends['DECLINING'] = trends['BR_SLOPE'].lt(0).astype('float64').where(trends['BR_SLOPE'].notna())
+
+
+# In[5]:
+
+
+print('Aggregating by county...')
+
+# Summarize the bridge trends in each county (the cube has one row per bridge). The
+#   share declining is a percentage of the bridges with a slope
+by_county = trends.groupby('ST_CNTY')
+county_trends = pd.DataFrame({'NUM_BRIDGES': by_county.size(),
+                              'MEAN_SLOPE': by_county['BR_SLOPE'].mean(),
+                              'MED_SLOPE': by_county['BR_SLOPE'].median(),
+                              'PCT_DECLINING': 100 * by_county['DECLINING'].mean(),
+                              'MEAN_LAST_RATING': by_county['LAST_RATING'].mean(),
+                              'MED_YRS_SINCE_DROP': by_county['YRS_SINCE_DROP'].median()}).reset_index()
+
+mw.write_table(trends.drop(columns='DECLINING'), bridge_path+'bridge_trends')
+mw.write_table(county_trends, county_path+'county_bridge_trends')
+
+# Write the step timings & record this run in the stage manifest
+mw.flush_timings('045')
+mw.record_stage('045', stage_inputs, stage_outputs, __file__)
+
+print('Finished')
@@ -7,159 +7,127 @@
 import pandas as pd
 import numpy as np
 import os
+import sys
 import mwlib as mw
 
 
 # In[2]:
 
 
-def get_coastal_areas(file, col):
-    # A function that returns a list of coastal counties
-    coastal = pd.read_csv(file, dtype=str)
-    counties = coastal[col].unique().copy()
-    return counties
-
-def get_fips(file, areas):
-    # A function for retrieving a dataframe describing the relationship between counties
-    #  and forecast zones
-    zones_counties = pd.read_csv(file, dtype=str, sep = '|', header = None)
-
-    # drop unwanted columns
-    keep_columns = [4, 6]
-    zones_counties = zones_counties[keep_columns].copy()
-    
-    # Rename headers
-    headers = ['ST_ZONE', 'CNTY_FIPS']
-    zones_counties.columns = headers
-
-    # Concatenate state abbreviation & county fips
-    zones_counties['ST_CNTY'] =  zones_counties.ST_ZONE.str[:2] + zones_counties.CNTY_FIPS.str[-3:]
-
-    # Drop all records not in a coastal county
-    zones_counties = zones_counties[zones_counties.CNTY_FIPS.isin(areas)].copy()
-    return zones_counties
-
-def get_state_codes(file):
-    # A function that builds a dictionary of state abbreviations & fips codes
-    county_data = pd.read_csv(file)
-    codes = county_data[['statefips','stateusps']]
-    codes = codes.drop_duplicates(subset=['statefips'], keep='first')
-    codes['statefips'] = codes['statefips'].astype(str)
-    codes = codes.set_index('statefips').to_dict()['stateusps']
-    return codes
-
 def cz_to_fz(stormdf, zones):
     # This function takes county storm data and replaces STATE_CZ value
-    #  witih the forecast zone number
-    
-    # Create an empty copy of the storm dataframe
-    c_to_z = pd.DataFrame(columns = stormdf.columns)
-
-    # Create a new, empty attribute
-    c_to_z['STATE_FZ'] = ''
-    stormdf['STATE_FZ'] = ''
-
-    storm_counties = stormdf.STATE_CZ.unique()
-
-    for c in storm_counties:
-        # Create a list of forecast zones in each coastal county
-        fc_zones = zones.ST_ZONE[zones.ST_CNTY == c].to_list()
-        
-        for z in fc_zones:
-            # For each zone in a county, copy the storm data
-            tempdf = stormdf[stormdf.STATE_CZ == c].copy()
-
-            # Populate forecast zone attribute
-            tempdf.STATE_FZ = z
+    #  witih the forecast zone number, copying each record to every zone in its county
+    #  with a single many-to-many join
+    c_to_z = stormdf.merge(zones[['ST_CNTY', 'ST_ZONE']], left_on = 'STATE_CZ', right_on = 'ST_CNTY')
 
-            # Concatenate current zone data with full dataframe
-            c_to_z = pd.concat([c_to_z, tempdf], ignore_index=True)
-
-    # Remove state-county attribute
-    c_to_z.drop('STATE_CZ', axis=1, inplace=True)
+    # Remove state-county attributes
+    c_to_z.drop(['STATE_CZ', 'ST_CNTY'], axis=1, inplace=True)
 
     # Rename column
-    c_to_z.rename(columns = {'STATE_FZ': 'STATE_CZ'}, inplace=True)
+    c_to_z.rename(columns = {'ST_ZONE': 'STATE_CZ'}, inplace=True)
     return c_to_z
 
-def clean_weather(c_z_type, keep_columns, zones):
+def counts_to_fz(county_counts, zones):
+    # This function takes event counts by county (indexed by STATE_CZ & EVENT_TYPE) and
+    #  projects them onto every forecast zone in the county. Zones that span more than
+    #  one county get the sum of their counties' counts, same as expanding the records
+    zone_counts = county_counts.rename('COUNT').reset_index()
+    zone_counts = zone_counts.merge(zones[['ST_CNTY', 'ST_ZONE']], left_on = 'STATE_CZ', right_on = 'ST_CNTY')
+    zone_counts = zone_counts.groupby(['ST_ZONE', 'EVENT_TYPE'])['COUNT'].sum()
+    return zone_counts.rename_axis(['STATE_CZ', 'EVENT_TYPE']).rename(None)
+
+def storm_keys(storms, state_fips):
+    # A function that adds the STATE_CZ key (state abbreviation & county/zone fips) to
+    #  a set of storm records
+
+    # Look up state abbreviations (remapping the fips for PR, GU, & VI to match NBI)
+    storms['STATE'] = mw.state_abbreviations(storms['STATE_FIPS'], state_fips, mw.NCEI_TERRITORY_FIPS)
+
+    # Concatenate state abbreviation & county fips to use as a key with bridge condition data
+    storms['STATE_CZ'] = mw.fips_key(storms['STATE'], storms['CZ_FIPS'])
+    return storms
+
+def count_chunk(storms, c_z_type, zones):
+    # A function that drops the storm records not in a coastal area & counts the rest
+    #  by STATE_CZ & EVENT_TYPE
+    if c_z_type == 'C':
+        storms = storms[storms.STATE_CZ.isin(zones.ST_CNTY)].copy()
+
+        if count_before_expanding:
+            # Count events by county, then project the counts onto forecast zones
+            return counts_to_fz(storms.groupby(['STATE_CZ','EVENT_TYPE']).size(), zones)
+
+        # Convert counties to forecast zones, then count
+        storms = cz_to_fz(storms, zones)
+    else:
+        storms = storms[storms.STATE_CZ.isin(zones.ST_ZONE)].copy()
+    return storms.groupby(['STATE_CZ','EVENT_TYPE']).size()
+
+@mw.timed_function(flush='050')
+def count_storms(file, c_z_types, keep_columns, zones, state_fips):
+    # A function that streams one NCEI detail file in chunks of chunk_rows records, reading
+    #  only keep_columns, and returns the coastal event counts for each CZ_TYPE in c_z_types.
+    #  Only the counts are kept between chunks, so memory doesn't grow with the file size
+    counts = {c_z_type: [] for c_z_type in c_z_types}
+    print('\t'+os.path.basename(file)[30:34], flush=True)
+
+    for chunk in pd.read_csv(file, usecols=keep_columns, dtype=str, chunksize=chunk_rows):
+        chunk = chunk[chunk['CZ_TYPE'].isin(c_z_types)]
+        if chunk.empty:
+            continue
+        chunk = storm_keys(chunk.copy(), state_fips)
+        for c_z_type, storms in chunk.groupby('CZ_TYPE'):
+            counts[c_z_type].append(count_chunk(storms, c_z_type, zones))
+
+    # Add up the chunk counts (a key can show up in more than one chunk)
+    for c_z_type, partials in counts.items():
+        if partials:
+            counts[c_z_type] = pd.concat(partials).groupby(level=['STATE_CZ', 'EVENT_TYPE']).sum()
+        else:
+            index = pd.MultiIndex.from_arrays([[], []], names=['STATE_CZ', 'EVENT_TYPE'])
+            counts[c_z_type] = pd.Series([], index=index, dtype='int64')
+    return counts
+
+def combine_counts(partials, years, c_z_type):
+    # A function that combines one type's counts from every year into one column per year.
+    #  The outer join keeps keys that are missing from some years (NaN for those years),
+    #  and sorting the keys makes the result independent of the order files finish in
+    columns = [partial[c_z_type].rename(year) for partial, year in zip(partials, years)]
+    if columns:
+        counts = pd.concat(columns, axis=1, join='outer').sort_index()
+    else:
+        counts = pd.DataFrame(index=pd.MultiIndex.from_arrays([[], []], names=['STATE_CZ', 'EVENT_TYPE']))
+    counts.insert(0, 'CZ_TYPE', c_z_type)
+    return counts
 
-    # Initialize a DataFrame to append event data to
-    counts = pd.DataFrame(columns = ['STATE_CZ', 'EVENT_TYPE', 'CZ_TYPE'])
-    counts = counts.set_index(['STATE_CZ', 'EVENT_TYPE'])
+def clean_weather(c_z_types, keep_columns, zones):
+    # A function that counts coastal events for every CZ_TYPE in c_z_types, reading each
+    #  NCEI file once and routing its records to each type's counts. Files are counted
+    #  independently (across CB_WORKERS processes) & the yearly counts combined at the end
 
     # Get a list of state fips numbers
-    state_fips = get_state_codes('input/Coastal_Counties.csv')
+    state_fips = mw.coastal_locations()['state_codes']
 
     # get a list of input files to process
-    list_of_files = mw.get_files(input_folder, '.csv')
+    list_of_files = sorted(mw.get_files(input_folder, '.csv'))
+    years = [file[30:34] for file in list_of_files]
 
-    # Print initial status message depending on c_z_type, test for unrecognized types
-    if c_z_type == 'C':
-        print('Working on counties for:')
-    elif c_z_type == 'Z':
-        print('Working on forecast zones for:')
-    else:
-        print('fips type not recognized')
+    # Test for unrecognized types
+    unknown = [c_z_type for c_z_type in c_z_types if c_z_type not in ('C', 'Z')]
+    if unknown:
+        print('fips type not recognized: ' + ', '.join(unknown))
         return
 
-    for file in sorted(list_of_files):
-
-        year = file[30:34]
-
-        print('\t'+year)
-    
-        # Read current file into DataFrame
-        storms = pd.read_csv(input_folder+file, dtype=str)
-
-        # Reduce storms dataframe down to only the columns of interest
-        storms = storms[keep_columns].copy()
-    
-        # Remove storms not in a county/parish
-        storms = storms[storms['CZ_TYPE'] == c_z_type]
-
-        # Replace fips for PR, GU, & VI to match NBI
-        storms['STATE_FIPS'] = storms['STATE_FIPS'].replace('98', '66')
-        storms['STATE_FIPS'] = storms['STATE_FIPS'].replace('96', '78')
-        storms['STATE_FIPS'] = storms['STATE_FIPS'].replace('99', '72')
-    
-        # Convert county fips to 3 character strings (filling w/ zeroes where necessary)
-        storms['STATE_FIPS2'] = storms['STATE_FIPS'].apply(lambda x: x.zfill(2))
-        storms['CZ_FIPS'] = storms['CZ_FIPS'].apply(lambda x: x.zfill(3))
-
-        # Concatenate state fips & county fips
-        storms['ST_CZ'] = storms['STATE_FIPS2'] + storms['CZ_FIPS']
-
-        # Add state abbreviations to dataframe
-        storms['STATE'] = storms['STATE_FIPS'].copy()
-
-        # Replace fips codes with state abbreviations
-        storms.replace({'STATE':state_fips}, inplace=True)
-    
-        # Concatenate state abbreviation & county fips to use as a key with bridge condition data
-        storms['STATE_CZ'] = storms['STATE'] + storms['CZ_FIPS']
-
-        # Drop all records not in a coastal area
-        if c_z_type == 'C':
-            storms = storms[storms.STATE_CZ.isin(zones.ST_CNTY)].copy()
-            
-            # Convert counties to forecast zones
-            storms = cz_to_fz(storms, zones)
-        elif c_z_type == 'Z':
-            storms = storms[storms.STATE_CZ.isin(zones.ST_ZONE)].copy()
-        else:
-            print('fips type not recognized')
-            break
-    
-        new_counts = pd.DataFrame(storms.groupby(['STATE_CZ','EVENT_TYPE']).size())
-        new_counts.rename(columns={0:year}, inplace=True)
+    print('Working on ' + ', '.join(type_names[c_z_type] for c_z_type in c_z_types) + ' for:')
 
-        # Merge in new counts
-        counts = counts.merge(new_counts, on=['STATE_CZ', 'EVENT_TYPE'], how = 'right').copy()
+    # Stream each file & count coastal events of every type
+    n = len(list_of_files)
+    partials = mw.parallel_map(count_storms, [input_folder+file for file in list_of_files],
+                               [c_z_types] * n, [keep_columns] * n, [zones] * n, [state_fips] * n)
 
-    counts['CZ_TYPE'] = c_z_type
+    counts = {c_z_type: combine_counts(partials, years, c_z_type) for c_z_type in c_z_types}
     print('Finished')
-    return counts, storms
+    return counts
 
 
 # In[3]:
@@ -169,11 +137,32 @@ def clean_weather(c_z_type, keep_columns, zones):
 input_folder = 'input/noaa_data/'
 output_folder = 'output/processed_weather/'
 
-# Create a list of coastal counties
-coastal_areas = get_coastal_areas('input/Coastal_Counties.csv', 'countyfips')
+# Count county events before projecting them onto forecast zones (instead of copying
+#  every event record to each zone)
+count_before_expanding = True
+
+# Event record types to count: 'C' county, 'Z' forecast zone. Marine zone ('M') records
+#  carry a marine area (e.g. GULF OF MEXICO) instead of a state, so they can't be keyed
+#  to coastal counties or forecast zones & aren't counted
+event_types = ['C', 'Z']
+type_names = {'C': 'counties', 'Z': 'forecast zones'}
+
+# Number of storm records to read from an NCEI file at a time
+chunk_rows = 100000
+
+# Skip this stage if its inputs & logic haven't changed since the last run
+stage_inputs = ([input_folder+file for file in mw.get_files(input_folder, '.csv')] +
+                ['input/Coastal_Counties.csv', 'input/bp05mr24.dbx'])
+stage_outputs = [mw.table_path(output_folder+'total_counts')]
+if mw.stage_is_current('050', stage_inputs, stage_outputs, __file__):
+    print('Weather counts up to date')
+    sys.exit()
+
+# Time the steps of this run
+mw.reset_timings('050')
 
 # Create a dataframe with coastal counties & forecast zones
-fczones = get_fips('input/bp05mr24.dbx', coastal_areas)
+fczones = mw.forecast_zones()['zones']
 
 # List all attributes needed for the analysis
 keep_columns = ['EVENT_ID',                  #1
@@ -183,18 +172,16 @@ keep_columns = ['EVENT_ID',                  #1
                 'CZ_FIPS'                    #5
                 ]
 
-# Count extreme events by county & project onto forecast zones
-county_counts, cstorms = clean_weather('C', keep_columns, fczones)
-#county_counts.to_csv(output_folder+'county_event_counts.csv', index=True)
-
-# Count extreme events by NWS forecast zone
-zone_counts, zstorms = clean_weather('Z', keep_columns, fczones)
-#zone_counts.to_csv(output_folder+'zone_event_counts.csv', index=True)
+# Count extreme events by county (projected onto forecast zones) & by NWS forecast
+#  zone in one pass over the NCEI files
+weather_counts = clean_weather(event_types, keep_columns, fczones)
 
-#marine_counts, mstorms = clean_weather('M', keep_columns, fczones)
+total_counts = pd.concat([weather_counts[c_z_type] for c_z_type in event_types])
+mw.write_table(total_counts.reset_index(), output_folder+'total_counts')
 
-total_counts = pd.concat([county_counts, zone_counts])
-total_counts.to_csv(output_folder+'total_counts.csv', index=True)
+# Write the step timings & record this run in the stage manifest
+mw.flush_timings('050')
+mw.record_stage('050', stage_inputs, stage_outputs, __file__)
 
 
 # # BONEYARD
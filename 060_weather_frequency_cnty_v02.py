@@ -4,43 +4,20 @@
 # In[1]:
 
 
+import os
+import sys
 import numpy as np
 import pandas as pd
 import statsmodels.api as sm
+import mwlib as mw
 
 
 # In[2]:
 
 
-def get_coastal_areas(file, col):
-    # A function that returns a list of coastal counties
-    coastal = pd.read_csv(file, dtype=str)
-    counties = coastal[col].unique().copy()
-    return counties
-
-def get_fips(file, areas):
-    # A function for retrieving a dataframe describing the relationship between counties
-    #  and forecast zones
-    zones_counties = pd.read_csv(file, dtype=str, sep = '|', header = None)
-
-    # drop unwanted columns
-    keep_columns = [4, 6]
-    zones_counties = zones_counties[keep_columns].copy()
-    
-    # Rename headers
-    headers = ['ST_ZONE', 'CNTY_FIPS']
-    zones_counties.columns = headers
-
-    # Concatenate state abbreviation & county fips
-    zones_counties['ST_CNTY'] =  zones_counties.ST_ZONE.str[:2] + zones_counties.CNTY_FIPS.str[-3:]
-
-    # Drop all records not in a coastal county
-    zones_counties = zones_counties[zones_counties.CNTY_FIPS.isin(areas)].copy()
-    return zones_counties
-
 def glm_slope(storms, years):
     # A function that returns the slope and p_value for a line of best fit to count
-    #  data using the GLM Poisson regressn
+    #  data using the GLM Poisson regressn (exact statsmodels path, see glm_method)
     
     # create a dataframe of input data
     df_dict = {'year': years, 'storms': storms}
@@ -64,6 +41,21 @@ def glm_slope(storms, years):
 input_path = 'output/processed_weather/'
 output_path = 'output/processed_weather/'
 
+# 'batched' fits every county at once with mw.poisson_trend, 'statsmodels' fits each
+#  county with sm.GLM across CB_WORKERS processes
+glm_method = os.environ.get('CB_GLM', 'batched')
+
+# Skip this stage if its inputs & logic haven't changed since the last run
+stage_inputs = [mw.table_path(input_path+'total_counts'),
+                'input/Coastal_Counties.csv', 'input/bp05mr24.dbx']
+stage_outputs = [mw.table_path(output_path+'cnty_storm_history')]
+if mw.stage_is_current('060', stage_inputs, stage_outputs, __file__):
+    print('Storm history up to date')
+    sys.exit()
+
+# Time the steps of this run
+mw.reset_timings('060')
+
 
 # In[4]:
 
@@ -71,7 +63,7 @@ output_path = 'output/processed_weather/'
 print('Calculating storm events by county...')
 
 # Read in county events
-all_events = pd.read_csv(input_path+'total_counts.csv')
+all_events = mw.read_table(input_path+'total_counts')
 
 # List of events to disregard
 drop_events = ['Rip Current', 'High Surf', 'Heat', 'Dense Fog', 'Sneakerwave',
@@ -88,14 +80,8 @@ for event in drop_events:
 years_str = all_events.columns[4:]
 years = list(map(int, years_str))
 
-# Create a list of coastal counties
-coastal_areas = get_coastal_areas('input/Coastal_Counties.csv', 'countyfips')
-
-# Create a dataframe with coastal counties & forecast zones
-fczones = get_fips('input/bp05mr24.dbx', coastal_areas)
-
 # Create dictionary  of forecast zones & counties
-fc_dict = dict(zip(fczones['ST_ZONE'], fczones['ST_CNTY']))
+fc_dict = mw.forecast_zones()['zone_counties']
 
 # Map counties to forecast zones
 all_events.ST_CNTY = all_events[all_events.CZ_TYPE == 'Z']['STATE_CZ'].map(fc_dict).copy()
@@ -118,18 +104,31 @@ hist = total_cnty_events.loc[total_cnty_events.iloc[:,2:].count(axis=1) >= 10].c
 hist = hist.reset_index()
 
 # For each county, calculate slope for line of best fit through event counts over time
-slope = []
-p_val = []
-for index, row in hist.iterrows():
-    values = row.values[2:].tolist()
-    slope_i, p_val_i = glm_slope(values, years)
-    slope.append(slope_i)
-    p_val.append(p_val_i)
+counts = hist[years_str].to_numpy(dtype='float64')
+if glm_method == 'statsmodels':
+    fits = mw.parallel_map(glm_slope, counts.tolist(), [years] * len(counts), chunksize=16)
+    slope = [fit[0] for fit in fits]
+    p_val = [fit[1] for fit in fits]
+else:
+    trend = mw.poisson_trend(counts, years)
+    slope = trend['slope'].to_numpy()
+    p_val = trend['p_value'].to_numpy()
+
+    if mw.VALIDATE:
+        # Compare with a statsmodels fit of each county
+        fits = mw.parallel_map(glm_slope, counts.tolist(), [years] * len(counts), chunksize=16)
+        print('\tmax difference from statsmodels: slope %.3g, p-value %.3g' % (
+            np.max(np.abs(slope - [fit[0] for fit in fits]), initial=0),
+            np.max(np.abs(p_val - [fit[1] for fit in fits]), initial=0)))
 
 hist.insert(2, 'STORM_RATE', slope)
 hist.insert(3, 'P_VAL', p_val)
 hist.pop('index');
 
-hist.to_csv(output_path+'cnty_storm_history.csv', index = False)
+mw.write_table(hist, output_path+'cnty_storm_history')
+
+# Write the step timings & record this run in the stage manifest
+mw.flush_timings('060')
+mw.record_stage('060', stage_inputs, stage_outputs, __file__)
 print('Finished')
 
@@ -4,6 +4,7 @@
 # In[1]:
 
 
+import sys
 import pandas as pd
 import mwlib as mw
 
@@ -17,49 +18,20 @@ def get_years(files):
         years.append(file[6:10])
     return years      
 
-def get_state_fips(file):
-    # A function that takes a file input and returns a dictionary of state fips numbers
-    #  and the state two letter abbreviation
-    
-    df = pd.read_csv(file)
-
-    # Truncate dataframe down to just state abbreviations & fips numbers
-    st_fips = df[['STATE', 'FIPS']].copy()
-
-    # Convert fips numbers to strings and slice off first 1-2 characters (state fips)
-    st_fips['FIPS'] = st_fips['FIPS'].apply(str).str.slice(start = 0, stop = -3).copy()
-
-    # de-dup dataframe
-    st_fips = st_fips[~st_fips.STATE.duplicated(keep = 'first')]
-
-    # Convert to a dictionary & return
-    #st_fips.set_index('FIPS', inplace = True)
-    
-    return dict(zip(st_fips['FIPS'], st_fips['STATE']))
-
-def get_coastal_locations(path):
-    # A function that returns a list of coastal states & counties
-    coastal = pd.read_csv(path+'Coastal_Counties.csv', dtype=str)
-    states = coastal['stateusps'].unique().copy()
-    counties = coastal['countyfips'].unique().copy()
-    return states, counties
-
+@mw.timed_function()
 def pop_change(df, pop_attribute):
     # List of columns to keep in second year file
     keep_cols = ['STATE', 'COUNTY', pop_attribute]
     df = df[keep_cols].copy()
 
     # Convert county fips to strings & fill with 0s to 3 characters
-    df['COUNTY'] = df['COUNTY'].apply(str)
-    df['COUNTY'] = df['COUNTY'].apply(lambda x: x.zfill(3))
+    df['COUNTY'] = mw.pad_fips(df['COUNTY'], 3)
 
-    # Convert state fips to strings
-    df['STATE'] = df['STATE'].apply(str)
-
-    df['STATE_ABV'] = df['STATE'].map(state_fips)
+    # Look up state abbreviations
+    df['STATE_ABV'] = mw.state_abbreviations(df['STATE'], state_fips)
 
     # Fill state fips to two digits
-    df['STATE'] = df['STATE'].apply(lambda x: x.zfill(2))
+    df['STATE'] = mw.pad_fips(df['STATE'], 2)
 
     # Create state fips + county fips attribute
     df['CNTY_FIPS'] = df['STATE'] + df['COUNTY']
@@ -81,16 +53,26 @@ output_path = 'output/census/'
 # Get a list of files in the input path
 list_of_files = mw.get_files(input_path, '.csv')
 
+# Skip this stage if its inputs & logic haven't changed since the last run
+stage_inputs = ([input_path+file for file in list_of_files] +
+                ['input/state_zone.csv', 'input/Coastal_Counties.csv'])
+stage_outputs = [mw.table_path(output_path+'population_by_county')]
+if mw.stage_is_current('070', stage_inputs, stage_outputs, __file__):
+    print('Population up to date')
+    sys.exit()
+
+# Time the steps of this run
+mw.reset_timings('070')
+
 # Read in census data
 first_year = pd.read_csv(input_path+sorted(list_of_files, reverse = False)[0], encoding='unicode_escape')
 second_year = pd.read_csv(input_path+sorted(list_of_files, reverse = False)[1], encoding='unicode_escape')
 
 # Create a dataframe with state abbreviations & state fips numbers
-state_fips = get_state_fips('input/state_zone.csv')
+state_fips = mw.census_states()
 
 # Get a list of coastal counties
-
-coastal_states, coastal_counties = get_coastal_locations('input/')
+coastal_counties = mw.coastal_locations()['counties']
 
 
 # In[4]:
@@ -125,5 +107,9 @@ population_df.pop('STATE_ABV');
 population_df.pop('CNTY_FIPS');
 
 # Write dataframe to file
-population_df.to_csv(output_path+'population_by_county.csv', index=False)
+mw.write_table(population_df, output_path+'population_by_county')
+
+# Write the step timings & record this run in the stage manifest
+mw.flush_timings('070')
+mw.record_stage('070', stage_inputs, stage_outputs, __file__)
 
@@ -4,18 +4,33 @@
 # In[1]:
 
 
+import sys
 import pandas as pd
 import numpy as np
+import mwlib as mw
 
 
 # In[2]:
 
 
+# Skip this stage if its inputs & logic haven't changed since the last run
+stage_inputs = [mw.table_path('output/structure_age/ages_by_county'),
+                mw.table_path('output/processed_weather/cnty_storm_history'),
+                mw.table_path('output/county_groups/avg_county_rating'),
+                mw.table_path('output/census/population_by_county')]
+stage_outputs = ['output/all_county_data.csv']
+if mw.stage_is_current('100', stage_inputs, stage_outputs, __file__):
+    print('County data up to date')
+    sys.exit()
+
+# Time the steps of this run
+mw.reset_timings('100')
+
 # Read all county data into memory
-structure_age = pd.read_csv('output/structure_age/ages_by_county.csv')
-weather_counts = pd.read_csv('output/processed_weather/cnty_storm_history.csv')
-bridge_condition = pd.read_csv('output/county_groups/avg_county_rating.csv')
-population = pd.read_csv('output/census/population_by_county.csv')
+structure_age = mw.read_table('output/structure_age/ages_by_county')
+weather_counts = mw.read_table('output/processed_weather/cnty_storm_history', ['ST_CNTY', 'STORM_RATE', 'P_VAL'])
+bridge_condition = mw.read_table('output/county_groups/avg_county_rating', ['ST_CNTY', 'BR_RATE'])
+population = mw.read_table('output/census/population_by_county', ['ST_CNTY', 'RATIO'])
 
 # Create a dataframe to store all county data
 county_data = structure_age.copy()
@@ -75,6 +90,10 @@ county_data.loc[county_data['SUM_FLAGS'] == 4]
 
 county_data.to_csv('output/all_county_data.csv', index = False)
 
+# Write the step timings & record this run in the stage manifest
+mw.flush_timings('100')
+mw.record_stage('100', stage_inputs, stage_outputs, __file__)
+
 
 # In[4]:
 
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Benchmark: growing a DataFrame with pd.concat inside a loop versus collecting
+#  the pieces in a list and concatenating once. Uses a synthetic inventory of
+#  50 states x 30 years shaped like the cleaned NBI files written by 010.
+#
+# Usage: python benchmarks/bench_concat.py [bridges_per_state]
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+
+def make_state_frame(rng, n_rows, state_code):
+    # A function that builds a synthetic cleaned state inventory
+    df = pd.DataFrame({'STATE_CODE_001': state_code,
+                       'STRUCTURE_NUMBER_008': np.char.zfill(np.arange(n_rows).astype(str), 15),
+                       'COUNTY_CODE_003': np.char.zfill(rng.integers(1, 200, n_rows).astype(str), 3),
+                       'LAT_016': rng.integers(25000000, 48000000, n_rows),
+                       'LONG_017': rng.integers(70000000, 124000000, n_rows),
+                       'YEAR_BUILT_027': rng.integers(1900, 2024, n_rows).astype(str)})
+    for col in ['DECK_COND_058', 'SUPERSTRUCTURE_COND_059', 'SUBSTRUCTURE_COND_060',
+                'CHANNEL_COND_061', 'CULVERT_COND_062', 'SCOUR_CRITICAL_113']:
+        df[col] = rng.choice(list('0123456789N'), n_rows)
+    return df
+
+def concat_in_loop(frames, columns):
+    # The original accumulation pattern
+    acc = pd.DataFrame(columns = columns)
+    for frame in frames:
+        acc = pd.concat([acc, frame])
+    return acc
+
+def concat_once(frames, columns):
+    # Collect-then-concat-once
+    return pd.concat(frames)
+
+def time_it(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, len(result)
+
+
+n_states, n_years = 50, 30
+n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+rng = np.random.default_rng(0)
+
+# One state-year frame per state for a single year (the 010 inner loop)
+year_frames = [make_state_frame(rng, n_rows, '%02d' % (i + 1)) for i in range(n_states)]
+columns = list(year_frames[0].columns)
+
+# One frame per year for the whole series (the init_time_ser loop in 020 & 030)
+series_frames = [pd.concat(year_frames)[['STATE_CODE_001', 'STRUCTURE_NUMBER_008', 'COUNTY_CODE_003']]
+                 for _ in range(n_years)]
+
+print('%d states x %d years, %d bridges per state' % (n_states, n_years, n_rows))
+for label, frames in [('states in one year', year_frames), ('years in time series', series_frames)]:
+    for name, func in [('concat in loop', concat_in_loop), ('concat once', concat_once)]:
+        seconds, rows = time_it(func, frames, columns)
+        print('\t%-22s %-15s %9.3f s  (%d rows)' % (label, name, seconds, rows))
+
+# Full 010 run: 30 years of 50 states each
+for name, func in [('concat in loop', concat_in_loop), ('concat once', concat_once)]:
+    start = time.perf_counter()
+    for _ in range(n_years):
+        func(year_frames, columns)
+    print('\t%-22s %-15s %9.3f s' % ('30 year 010 run', name, time.perf_counter() - start))
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Benchmark: projecting county storm events onto NWS forecast zones in 050. Compares
+#  the original nested county/zone loop, the many-to-many join (cz_to_fz) and counting
+#  before projecting (counts_to_fz) on a synthetic decade of NCEI county events.
+#
+# Usage: python benchmarks/bench_cz_to_fz.py [events_per_year] [years] [--skip-loop]
+
+import sys
+import numpy as np
+import pandas as pd
+from bench_utils import load_functions, time_it
+
+weather = load_functions('050_weather_cleaning_v06.py')
+
+
+def cz_to_fz_loop(stormdf, zones):
+    # The original implementation: filter & concatenate one copy per county & zone
+    c_to_z = pd.DataFrame(columns = stormdf.columns)
+    c_to_z['STATE_FZ'] = ''
+    stormdf['STATE_FZ'] = ''
+    for c in stormdf.STATE_CZ.unique():
+        fc_zones = zones.ST_ZONE[zones.ST_CNTY == c].to_list()
+        for z in fc_zones:
+            tempdf = stormdf[stormdf.STATE_CZ == c].copy()
+            tempdf.STATE_FZ = z
+            c_to_z = pd.concat([c_to_z, tempdf], ignore_index=True)
+    c_to_z.drop('STATE_CZ', axis=1, inplace=True)
+    c_to_z.rename(columns = {'STATE_FZ': 'STATE_CZ'}, inplace=True)
+    return c_to_z
+
+def make_zones(rng, n_counties):
+    # A synthetic county/zone table: 1-6 zones per county, some zones shared by neighbours
+    rows = []
+    for c in range(n_counties):
+        county = 'S%d%03d' % (c // 100, c % 100)
+        for z in range(rng.integers(1, 7)):
+            rows.append((county[:2] + '%03d' % ((c * 5 + z) % 1000), county))
+    return pd.DataFrame(rows, columns = ['ST_ZONE', 'ST_CNTY'])
+
+def make_events(rng, zones, n_events):
+    # Synthetic county events spread over the coastal counties
+    return pd.DataFrame({'EVENT_ID': np.arange(n_events).astype(str),
+                         'EVENT_TYPE': rng.choice(['Flood', 'Hail', 'Thunderstorm Wind', 'Hurricane',
+                                                   'Flash Flood', 'Tornado'], n_events),
+                         'STATE_CZ': rng.choice(zones.ST_CNTY.unique(), n_events)})
+
+def by_loop(events, zones):
+    return cz_to_fz_loop(events.copy(), zones).groupby(['STATE_CZ', 'EVENT_TYPE']).size()
+
+def by_join(events, zones):
+    return weather['cz_to_fz'](events, zones).groupby(['STATE_CZ', 'EVENT_TYPE']).size()
+
+def by_counts(events, zones):
+    return weather['counts_to_fz'](events.groupby(['STATE_CZ', 'EVENT_TYPE']).size(), zones)
+
+
+args = [a for a in sys.argv[1:] if not a.startswith('--')]
+n_events = int(args[0]) if len(args) > 0 else 40000
+n_years = int(args[1]) if len(args) > 1 else 10
+rng = np.random.default_rng(0)
+zones = make_zones(rng, 1000)
+years = [make_events(rng, zones, n_events) for _ in range(n_years)]
+
+print('%d years x %d county events, %d counties, %d county-zone pairs' % (
+    n_years, n_events, zones.ST_CNTY.nunique(), len(zones)))
+
+methods = [('join then count', by_join), ('count then join', by_counts)]
+if '--skip-loop' not in sys.argv:
+    methods.insert(0, ('nested loop', by_loop))
+
+results = {}
+for name, func in methods:
+    total = 0.0
+    for events in years:
+        seconds, counts = time_it(func, events, zones)
+        total += seconds
+    results[name] = counts.sort_index()
+    print('\t%-16s %9.3f s for %d years (%d zone/event counts in last year)' % (name, total, n_years, len(counts)))
+
+# All methods must agree
+first = list(results.values())[0]
+for name, counts in results.items():
+    assert (counts.to_numpy() == first.to_numpy()).all(), name
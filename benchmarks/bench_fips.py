@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Benchmark: building fips codes & location keys. Compares the original per-element
+#  .apply/.replace code of 010 (ST_CNTY), 050 (STATE_CZ) and 070 (CNTY_FIPS & ST_CNTY)
+#  with the lookup-based helpers in mwlib on synthetic records.
+#
+# Usage: python benchmarks/bench_fips.py [records]
+
+import sys
+import numpy as np
+import pandas as pd
+from bench_utils import time_it
+import mwlib as mw
+
+
+def nbi_keys_apply(nbi):
+    # 010 clean_nbi
+    nbi['COUNTY_CODE_003'] = nbi['COUNTY_CODE_003'].apply(int).apply(str)
+    nbi['COUNTY_CODE_003'] = nbi['COUNTY_CODE_003'].apply(lambda x: x.zfill(3))
+    return nbi['STATE'] + nbi['COUNTY_CODE_003']
+
+def nbi_keys_lookup(nbi):
+    return mw.fips_key(nbi['STATE'], nbi['COUNTY_CODE_003'])
+
+def storm_keys_apply(storms, state_fips):
+    # 050 clean_weather
+    storms['STATE_FIPS'] = storms['STATE_FIPS'].replace('98', '66')
+    storms['STATE_FIPS'] = storms['STATE_FIPS'].replace('96', '78')
+    storms['STATE_FIPS'] = storms['STATE_FIPS'].replace('99', '72')
+    storms['STATE_FIPS2'] = storms['STATE_FIPS'].apply(lambda x: x.zfill(2))
+    storms['CZ_FIPS'] = storms['CZ_FIPS'].apply(lambda x: x.zfill(3))
+    storms['ST_CZ'] = storms['STATE_FIPS2'] + storms['CZ_FIPS']
+    storms['STATE'] = storms['STATE_FIPS'].copy()
+    storms.replace({'STATE':state_fips}, inplace=True)
+    return storms['STATE'] + storms['CZ_FIPS']
+
+def storm_keys_lookup(storms, state_fips):
+    states = mw.state_abbreviations(storms['STATE_FIPS'], state_fips, mw.NCEI_TERRITORY_FIPS)
+    return mw.fips_key(states, storms['CZ_FIPS'])
+
+def census_keys_apply(df, state_fips):
+    # 070 pop_change
+    df['COUNTY'] = df['COUNTY'].apply(str)
+    df['COUNTY'] = df['COUNTY'].apply(lambda x: x.zfill(3))
+    df['STATE'] = df['STATE'].apply(str)
+    df['STATE_ABV'] = df['STATE'].map(state_fips)
+    df['STATE'] = df['STATE'].apply(lambda x: x.zfill(2))
+    return df['STATE'] + df['COUNTY'], df['STATE_ABV'] + df['COUNTY']
+
+def census_keys_lookup(df, state_fips):
+    county = mw.pad_fips(df['COUNTY'], 3)
+    return (mw.pad_fips(df['STATE'], 2) + county,
+            mw.state_abbreviations(df['STATE'], state_fips) + county)
+
+
+n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+rng = np.random.default_rng(0)
+
+# Every state, DC & the territories, with NCEI numbering for PR, GU & VI in the storms
+state_fips = {str(fips): 'S%02d' % fips for fips in list(range(1, 57)) + [66, 72, 78]}
+fips = rng.choice([int(code) for code in state_fips], n)
+ncei_fips = pd.Series(fips).replace({66: 98, 78: 96, 72: 99}).astype(str)
+county = rng.integers(1, 300, n)
+
+nbi = pd.DataFrame({'STATE': rng.choice(list(state_fips.values()), n), 'COUNTY_CODE_003': county.astype(str)})
+storms = pd.DataFrame({'STATE_FIPS': ncei_fips, 'CZ_FIPS': county.astype(str)})
+census = pd.DataFrame({'STATE': fips, 'COUNTY': county})
+
+print('%d records' % n)
+cases = [('010 ST_CNTY', nbi_keys_apply, nbi_keys_lookup, (nbi,)),
+         ('050 STATE_CZ', storm_keys_apply, storm_keys_lookup, (storms, state_fips)),
+         ('070 census keys', census_keys_apply, census_keys_lookup, (census, state_fips))]
+
+for name, old, new, args in cases:
+    old_seconds, old_keys = time_it(old, *[a.copy() if isinstance(a, pd.DataFrame) else a for a in args])
+    new_seconds, new_keys = time_it(new, *[a.copy() if isinstance(a, pd.DataFrame) else a for a in args])
+    print('\t%-16s apply %8.3f s   lookup %8.3f s   (%.1fx)' % (name, old_seconds, new_seconds,
+                                                              old_seconds / new_seconds))
+
+    # Both must build the same keys
+    for old_key, new_key in zip(old_keys if isinstance(old_keys, tuple) else (old_keys,),
+                                new_keys if isinstance(new_keys, tuple) else (new_keys,)):
+        assert old_key.equals(new_key), name
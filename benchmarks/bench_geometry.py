@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Benchmark: rebuilding bridge points in 020/030. Compares parsing WKT one row at a time
+#  (the original time_ser['geometry'].apply(wkt.loads)), vectorized WKT & WKB decoding
+#  (what reading a CSV or GeoParquet geometry column costs) and building the points
+#  from the LONG_DEC/LAT_DEC columns with mw.bridge_points.
+#
+# Usage: python benchmarks/bench_geometry.py [points]
+
+import sys
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from shapely import wkt
+from bench_utils import time_it
+import mwlib as mw
+
+
+def by_wkt_apply(df):
+    return gpd.GeoDataFrame(df, geometry=df['WKT'].apply(wkt.loads), crs='epsg:4326')
+
+def by_wkt_vectorized(df):
+    return gpd.GeoDataFrame(df, geometry=gpd.GeoSeries.from_wkt(df['WKT']), crs='epsg:4326')
+
+def by_wkb(df):
+    return gpd.GeoDataFrame(df, geometry=gpd.GeoSeries.from_wkb(df['WKB']), crs='epsg:4326')
+
+def by_coordinates(df):
+    return mw.bridge_points(df)
+
+
+n = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+rng = np.random.default_rng(0)
+bridges = pd.DataFrame({'STATE_STR': np.arange(n).astype(str),
+                        'LONG_DEC': rng.uniform(-125, -66, n),
+                        'LAT_DEC': rng.uniform(24, 49, n)})
+points = shapely.points(bridges['LONG_DEC'], bridges['LAT_DEC'])
+bridges['WKT'] = shapely.to_wkt(points, rounding_precision=-1)
+bridges['WKB'] = shapely.to_wkb(points)
+
+print('%d points' % n)
+results = {}
+for name, func in [('wkt.loads apply', by_wkt_apply), ('from_wkt', by_wkt_vectorized),
+                   ('from_wkb', by_wkb), ('points_from_xy', by_coordinates)]:
+    seconds, gdf = time_it(func, bridges)
+    results[name] = gdf
+    print('\t%-16s %8.3f s  (%.0f points/s)' % (name, seconds, n / seconds))
+
+# All methods must build the same points
+first = results['points_from_xy'].geometry
+for name, gdf in results.items():
+    assert gdf.geometry.geom_equals_exact(first, tolerance=1e-9).all(), name
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Benchmark: the whole pipeline, stage by stage, on synthetic inputs (synthetic_data.py)
+#  so it runs offline. Each stage (010 through 100) is run as its own process from the
+#  data folder with CB_FORCE=1, one at a time, and its wall time is recorded along with
+#  its peak memory & slowest steps (from output/logs/<stage>_timings.csv). Results are
+#  appended to a JSON history & compared with the last run at the same scale on the
+#  same machine; stages that got slower by more than the threshold are reported as
+#  regressions & the script exits with code 1.
+#
+# Usage: python benchmarks/bench_pipeline.py [--data FOLDER] [--states N] [--counties N]
+#          [--bridges N] [--years N] [--events N] [--repeat N] [--threshold 0.2]
+#          [--history benchmarks/history.json] [--no-record]
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import datetime as dt
+import pandas as pd
+from bench_utils import ROOT
+import synthetic_data
+from run_pipeline import STAGES, OUTPUT_DIRS
+import mwlib as mw
+
+
+# Stages whose wall time changes by less than this are never called regressions (s)
+MIN_CHANGE_SECONDS = 0.5
+
+
+def run_stage(name, folder):
+    # A function that runs one stage script in the data folder, logging its output to
+    #  output/logs/<stage>.log. Returns the exit code & wall time
+    env = dict(os.environ, CB_FORCE='1')
+    with open(os.path.join(folder, 'output/logs', name + '.log'), 'w') as log:
+        start = time.perf_counter()
+        returncode = subprocess.call([sys.executable, os.path.join(ROOT, STAGES[name]['script'])],
+                                     cwd=folder, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return returncode, time.perf_counter() - start
+
+def stage_profile(name, folder, top=5):
+    # A function that returns the peak memory (MB) of a stage's last run, from the step
+    #  timings it wrote (the largest of its processes), & the total time of its slowest steps
+    path = os.path.join(folder, mw.timings_path(name))
+    if not os.path.exists(path):
+        return 0.0, {}
+    timings = pd.read_csv(path)
+    steps = timings.groupby('step')['seconds'].sum().sort_values(ascending=False)
+    return timings['peak_rss_mb'].max(skipna=True) if len(timings) else 0.0, {step: round(seconds, 3) for step, seconds in steps.head(top).items()}
+
+def git_commit():
+    # A function that returns the checked out commit, marked if there are local changes
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return commit + ('-dirty' if dirty else '')
+
+def load_json(path):
+    # A function that reads a JSON file, an empty list if there is none yet
+    if not os.path.exists(path):
+        return []
+    with open(path) as file:
+        return json.load(file)
+
+def previous_run(history, entry):
+    # A function that returns the last recorded run comparable with this one: same scale,
+    #  machine, worker count & table format
+    keys = ['scale', 'host', 'workers', 'table_format']
+    for run in reversed(history):
+        if all(run.get(key) == entry[key] for key in keys):
+            return run
+    return None
+
+def compare(entry, previous, threshold):
+    # A function that prints each stage's time against the previous run & returns the
+    #  stages that slowed down by more than the threshold
+    regressions = []
+    print('\n\tstage  %-34s %8s %8s %8s %9s' % ('script', 'seconds', 'before', 'change', 'peak MB'))
+    for name, result in entry['stages'].items():
+        before = previous['stages'].get(name, {}).get('seconds') if previous else None
+        change = ''
+        if before:
+            change = '%+.0f%%' % (100 * (result['seconds'] / before - 1))
+            if (result['seconds'] > before * (1 + threshold)
+                    and result['seconds'] - before > MIN_CHANGE_SECONDS):
+                regressions.append(name)
+                change += ' !'
+        print('\t%s    %-34s %8.2f %8s %8s %9.0f' % (
+            name, STAGES[name]['script'], result['seconds'],
+            '%.2f' % before if before else '-', change, result['peak_rss_mb']))
+    print('\ttotal  %-34s %8.2f' % ('', entry['total_seconds']))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time each pipeline stage on synthetic inputs')
+    parser.add_argument('--data', help='folder for the synthetic inputs & outputs (kept; '
+                                       'inputs already there are reused). Default: a temporary folder')
+    parser.add_argument('--states', type=int, default=4)
+    parser.add_argument('--counties', type=int, default=10)
+    parser.add_argument('--bridges', type=int, default=2000)
+    parser.add_argument('--years', type=int, default=8)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help='runs of each stage, the fastest is kept')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown reported as a regression')
+    parser.add_argument('--history', default=os.path.join(ROOT, 'benchmarks', 'history.json'))
+    parser.add_argument('--no-record', action='store_true', help="don't add this run to the history")
+    args = parser.parse_args()
+
+    folder = args.data or tempfile.mkdtemp(prefix='cb_bench_')
+    scale = {'states': args.states, 'counties': args.counties, 'bridges': args.bridges,
+             'first_year': 1996, 'years': args.years, 'events': args.events, 'seed': args.seed}
+    try:
+        # Write the inputs, unless this folder already has inputs at this scale from this
+        #  version of the generator
+        scale_file = os.path.join(folder, 'input', 'synthetic_scale.json')
+        written = dict(scale, generator=mw.file_hash(synthetic_data.__file__))
+        if load_json(scale_file) != written:
+            shutil.rmtree(os.path.join(folder, 'input'), ignore_errors=True)
+            start = time.perf_counter()
+            synthetic_data.generate(folder, **scale)
+            with open(scale_file, 'w') as file:
+                json.dump(written, file)
+            print('Wrote synthetic inputs to %s in %.1f s' % (folder, time.perf_counter() - start))
+        for directory in OUTPUT_DIRS:
+            os.makedirs(os.path.join(folder, directory), exist_ok = True)
+
+        # Run the stages in dependency order, one at a time
+        stages = {}
+        for name in STAGES:
+            runs = []
+            for _ in range(args.repeat):
+                returncode, seconds = run_stage(name, folder)
+                if returncode != 0:
+                    with open(os.path.join(folder, 'output/logs', name + '.log')) as log:
+                        print('Stage %s failed (exit code %s):' % (name, returncode))
+                        print(''.join(log.readlines()[-20:]))
+                    sys.exit(1)
+                peak_rss_mb, steps = stage_profile(name, folder)
+                runs.append((seconds, peak_rss_mb, steps))
+            seconds, peak_rss_mb, steps = min(runs, key=lambda run: run[0])
+            stages[name] = {'seconds': round(seconds, 3), 'peak_rss_mb': round(peak_rss_mb, 1),
+                            'slowest_steps': steps}
+            print('%s  %6.2f s  %6.0f MB' % (name, seconds, peak_rss_mb), flush=True)
+    finally:
+        if not args.data:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    entry = {'date': dt.datetime.now().isoformat(timespec='seconds'),
+             'commit': git_commit(),
+             'host': platform.node(),
+             'python': platform.python_version(),
+             'cpus': os.cpu_count(),
+             'workers': mw.WORKERS,
+             'table_format': mw.TABLE_FORMAT,
+             'scale': scale,
+             'stages': stages,
+             'total_seconds': round(sum(stage['seconds'] for stage in stages.values()), 3)}
+
+    history = load_json(args.history)
+    previous = previous_run(history, entry)
+    if previous:
+        print('\nCompared with %s (%s):' % (previous['commit'], previous['date']))
+    regressions = compare(entry, previous, args.threshold)
+
+    if not args.no_record:
+        history.append(entry)
+        with open(args.history, 'w') as file:
+            json.dump(history, file, indent=1)
+        print('Recorded in %s' % args.history)
+
+    if regressions:
+        print('\nSlower by more than %.0f%%: %s' % (100 * args.threshold, ', '.join(regressions)))
+        sys.exit(1)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Benchmark: memory taken by each year's processed bridge table in 010. Compares the
+#  original layout of process_nbi (ratings as float64 after an int64 lookup & a 999 to
+#  NaN replace, Lat & Long as int64, codes as strings) with the compact one (ratings as
+#  nullable Int8 from one lookup over all rating columns, Lat & Long as int32, codes as
+#  categoricals) on synthetic NBI files (synthetic_data.py), year by year.
+#
+# Usage: python benchmarks/bench_rating_dtypes.py [bridges_per_state] [states] [years]
+
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from bench_utils import load_functions, time_it
+import synthetic_data
+import mwlib as mw
+
+nbi = load_functions('010_nbi_cleaning_v10.py',
+                     ['keep_columns', 'rating_cols', 'rating_codes', 'rating_dtype',
+                      'rating_na', 'rating_values', 'code_cols'])
+
+
+def process_original(nbi_to_process, ratings, year):
+    # The original process_nbi layout
+    code_values = np.array([999 if code in ['N', 'n', 'T', 'U'] else int(code)
+                            for code in nbi['rating_codes']], dtype='int64')
+    for col in ratings:
+        nbi_to_process[col] = code_values[nbi_to_process[col].cat.codes]
+    nbi_to_process[ratings] = nbi_to_process[ratings].replace(999, np.nan).copy()
+    nbi_to_process['NUM_RATINGS'] = (nbi_to_process[ratings].isnull().sum(axis=1) - 6)*-1
+    nbi_to_process['MEAN_RATING'] = nbi_to_process[ratings].product(axis=1) **  (1/(nbi_to_process[ratings].isnull().sum(axis=1) - 6)*-1)
+    nbi_to_process['LOWEST_RATING'] = nbi_to_process[ratings].min(axis=1)
+    nbi_to_process = nbi_to_process[nbi_to_process.LOWEST_RATING <= 9].copy()
+    nbi_to_process['YEAR_BUILT_027'] = pd.to_numeric(nbi_to_process['YEAR_BUILT_027'], errors='coerce')
+    for col in ['LAT_016', 'LONG_017']:
+        nbi_to_process[col] = nbi_to_process[col].astype('int64')
+    nbi_to_process['LAT_DEC'] = nbi['dms'](nbi_to_process['LAT_016'])
+    nbi_to_process['LONG_DEC'] = nbi['dms'](nbi_to_process['LONG_017'])*(-1)
+    nbi_to_process['STATE_STR'] = nbi_to_process['STATE_CODE_001'] + nbi_to_process['STRUCTURE_NUMBER_008']
+    return mw.bridge_points(nbi_to_process)
+
+
+bridges = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+states = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+years = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+folder = tempfile.mkdtemp()
+start_dir = os.getcwd()
+try:
+    synthetic_data.generate(folder, states=states, bridges=bridges, years=years, events=100)
+    os.chdir(folder)
+    coastal = mw.coastal_locations()
+
+    print('%d states x %d bridges' % (states, bridges))
+    print('\tyear   bridges   original MB   compact MB   ratio   original s   compact s')
+    for directory in sorted(os.listdir('input/nbi_files')):
+        cleaned = []
+        for file in sorted(os.listdir('input/nbi_files/' + directory)):
+            state, year = file[:2], file[2:4]
+            if state in coastal['states']:
+                cleaned.append(nbi['clean_nbi']('input/nbi_files/%s/%s' % (directory, file), nbi['keep_columns'],
+                                                nbi['rating_cols'], state, year, coastal['counties']))
+                if state == 'NC' and int(year) >= 25:
+                    cleaned[-1] = nbi['fix_early_nc'](cleaned[-1])
+        cleaned = pd.concat(cleaned)
+
+        original_s, original = time_it(process_original, cleaned.copy(), nbi['rating_cols'], year)
+        compact_s, compact = time_it(nbi['process_nbi'], cleaned.copy(), nbi['rating_cols'], year)
+
+        # Both layouts must hold the same values
+        assert len(original) == len(compact)
+        for col in nbi['rating_cols'] + ['LOWEST_RATING', 'LAT_DEC', 'LONG_DEC', 'STATE_STR']:
+            assert original[col].astype(str).equals(compact[col].astype(original[col].dtype).astype(str)), col
+        assert np.allclose(original['MEAN_RATING'], compact['MEAN_RATING'], rtol=1e-12, atol=0)
+
+        before, after = mw.frame_mb(original), mw.frame_mb(compact)
+        print('\t%s %9d %13.1f %12.1f %6.1fx %12.3f %11.3f' % (
+            directory[:4], len(compact), before, after, before / after, original_s, compact_s))
+finally:
+    os.chdir(start_dir)
+    shutil.rmtree(folder)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Benchmark: summarizing the six ratings of every bridge in 010. Compares the original
+#  pandas passes (count of ratings, geometric mean as product ** (1/n), then min) with
+#  mw.rating_summary over the 2-D rating array, with & without the optional arithmetic
+#  & weighted means. Also checks the geometric mean of rows too long for a product.
+#
+# Usage: python benchmarks/bench_rating_summary.py [bridges]
+
+import sys
+import numpy as np
+import pandas as pd
+from bench_utils import time_it
+import mwlib as mw
+
+
+def summary_pandas(ratings):
+    # The original process_nbi passes
+    df = pd.DataFrame(ratings)
+    count = (df.isnull().sum(axis=1) - 6)*-1
+    mean_rating = df.product(axis=1) **  (1/(df.isnull().sum(axis=1) - 6)*-1)
+    lowest = df.min(axis=1)
+    return pd.DataFrame({'count': count, 'geometric_mean': mean_rating, 'lowest': lowest})
+
+def summary_kernel(ratings):
+    return mw.rating_summary(ratings)
+
+def summary_kernel_all(ratings):
+    return mw.rating_summary(ratings, mean=True,
+                             weights={'structural': [3, 3, 3, 1, 1, 1]})
+
+
+n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+rng = np.random.default_rng(0)
+ratings = rng.integers(0, 10, (n, 6)).astype('float64')
+ratings[rng.random((n, 6)) < 0.3] = np.nan
+
+print('%d bridges' % n)
+results = {}
+for name, func in [('pandas passes', summary_pandas), ('rating_summary', summary_kernel),
+                   ('+ mean & weighted', summary_kernel_all)]:
+    seconds, results[name] = time_it(func, ratings)
+    print('\t%-18s %8.3f s' % (name, seconds))
+
+# Same counts, lowest ratings & geometric means for bridges with ratings
+pandas_result, kernel = results['pandas passes'], results['+ mean & weighted']
+rated = kernel['count'] > 0
+assert (pandas_result['count'] == kernel['count']).all()
+assert np.allclose(pandas_result['lowest'][rated], kernel['lowest'][rated], rtol=0, atol=0)
+assert np.allclose(pandas_result['geometric_mean'][rated], kernel['geometric_mean'][rated], rtol=1e-12)
+assert np.allclose(kernel['mean'][rated], np.nanmean(ratings[rated], axis=1))
+
+# A product of 400 ratings of 9 overflows float64, their logs don't
+wide = np.full((1, 400), 9.0)
+with np.errstate(over='ignore'):
+    assert np.isinf(pd.DataFrame(wide).product(axis=1)[0])
+assert np.isclose(mw.rating_summary(wide)['geometric_mean'][0], 9.0)
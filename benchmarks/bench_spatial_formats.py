@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Benchmark: writing & reading bridge_ages (020) in each spatial output format
+#  (CB_SPATIAL_FORMAT) on synthetic bridge points, with the size of the files written.
+#
+# Usage: python benchmarks/bench_spatial_formats.py [points]
+
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from bench_utils import time_it
+import mwlib as mw
+
+
+def file_size(path):
+    # Size of a file plus its shapefile sidecars (.dbf, .shx, ...)
+    stem = os.path.splitext(path)[0]
+    folder = os.path.dirname(path)
+    return sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder)
+               if os.path.splitext(os.path.join(folder, f))[0] == stem)
+
+
+n = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+rng = np.random.default_rng(0)
+bridges = mw.bridge_points(pd.DataFrame({'STATE_STR': np.char.add('01', np.arange(n).astype(str)),
+                                         'LONG_DEC': rng.uniform(-125, -66, n),
+                                         'LAT_DEC': rng.uniform(24, 49, n),
+                                         'AGE': rng.integers(0, 120, n).astype(float),
+                                         'ST_CNTY': rng.choice(['AL001', 'FL086', 'NC019', 'TX167'], n)}))
+bridges = bridges[['STATE_STR', 'geometry', 'AGE', 'ST_CNTY']]
+
+folder = tempfile.mkdtemp()
+print('%d points' % n)
+try:
+    for spatial_format in mw.SPATIAL_EXTS:
+        mw.SPATIAL_FORMAT = spatial_format
+        os.makedirs(os.path.join(folder, spatial_format))
+        path = os.path.join(folder, spatial_format, 'bridge_ages')
+        write_seconds, _ = time_it(mw.write_spatial, bridges, path)
+        read_seconds, back = time_it(gpd.read_file if spatial_format != 'parquet' else gpd.read_parquet,
+                                     mw.spatial_path(path))
+        assert len(back) == n, spatial_format
+        print('\t%-8s write %7.2f s   read %7.2f s   %7.1f MB' % (
+            spatial_format, write_seconds, read_seconds, file_size(mw.spatial_path(path)) / 1e6))
+finally:
+    shutil.rmtree(folder)
@@ -0,0 +1,32 @@
+# Helpers shared by the benchmark scripts
+
+import os
+import sys
+import ast
+import time
+
+# Make the stage scripts' shared library importable from the benchmarks folder
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def load_functions(script, constants=()):
+    # A function that returns the imports & function definitions of a stage script as a
+    #  namespace, without running the script's top-level pipeline code. Top-level
+    #  assignments to the names listed in constants are run as well
+    path = os.path.join(ROOT, script)
+    with open(path) as file:
+        tree = ast.parse(file.read())
+    nodes = [node for node in tree.body
+             if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef))
+             or (isinstance(node, ast.Assign)
+                 and all(isinstance(t, ast.Name) and t.id in constants for t in node.targets))]
+    namespace = {'__file__': path}
+    exec(compile(ast.Module(body=nodes, type_ignores=[]), path, 'exec'), namespace)
+    return namespace
+
+def time_it(func, *args, **kwargs):
+    # A function that returns the wall time of a call & its result
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Synthetic inputs for benchmarking the whole pipeline without the FHWA, NCEI & Census
+#  downloads. Writes, under a target folder, everything the stages read:
+#    input/nbi_files/<year>hwybronefiledel/<ST><YY>.txt   NBI delimited files
+#    input/noaa_data/StormEvents_details-*_d<year>_*.csv  NCEI storm event details
+#    input/census/co-est2019-alldata.csv, co-est2021-alldata.csv
+#    input/Coastal_Counties.csv, input/bp05mr24.dbx, input/state_zone.csv
+#    input/cb_us_county_500k.shp                          county boundaries (for 015)
+#  Each state is a box of rectangular counties. Bridges keep their structure number,
+#  location & year built from year to year while their ratings decline with age, so the
+#  time series, trends & county averages have realistic shapes. NC files before 2000
+#  use the old short structure numbers, KS is included as a non-coastal state and a
+#  small share of fields are blank or out of place, as in the real files.
+#
+# Usage: python benchmarks/synthetic_data.py <folder> [--states N] [--counties N]
+#          [--bridges N] [--first-year YYYY] [--years N] [--events N] [--seed N]
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+
+# Coastal states: abbreviation, fips, center latitude & longitude of the box the
+#  state's counties are laid out in. NC comes early so small runs include its old
+#  structure numbers
+COASTAL_STATES = [('AL', 1, 32.8, -86.8), ('NC', 37, 35.5, -79.4), ('FL', 12, 28.6, -82.4),
+                  ('TX', 48, 31.5, -99.3), ('CA', 6, 37.2, -119.7), ('WA', 53, 47.4, -120.5),
+                  ('ME', 23, 45.4, -69.2), ('NY', 36, 42.9, -75.5), ('LA', 22, 31.0, -92.0),
+                  ('SC', 45, 33.9, -80.9), ('GA', 13, 32.7, -83.4), ('VA', 51, 37.5, -78.9),
+                  ('MD', 24, 39.0, -76.8), ('NJ', 34, 40.2, -74.7), ('MA', 25, 42.3, -71.8),
+                  ('OR', 41, 43.9, -120.6), ('MS', 28, 32.7, -89.7), ('CT', 9, 41.6, -72.7),
+                  ('DE', 10, 39.0, -75.5), ('RI', 44, 41.7, -71.5), ('NH', 33, 43.7, -71.6)]
+
+# A state that is never coastal, so the filtering steps have something to drop
+INLAND_STATE = ('KS', 20, 38.5, -98.4)
+
+# Marine areas that NCEI marine zone (M) records give as their state: name & fips
+MARINE_AREAS = [('GULF OF MEXICO', 85), ('ATLANTIC SOUTH', 87)]
+
+# Size of a state's box in degrees (latitude, longitude)
+STATE_BOX = (2.0, 3.0)
+
+# Share of each state's counties listed as coastal
+COASTAL_SHARE = 0.6
+
+# Columns of an NBI delimited file the pipeline reads, then the rest of the record.
+#  The rest are written as fixed values so the files are as wide as the real ones
+NBI_COLUMNS = ['STATE_CODE_001', 'STRUCTURE_NUMBER_008', 'RECORD_TYPE_005A', 'ROUTE_PREFIX_005B',
+               'COUNTY_CODE_003', 'PLACE_CODE_004', 'FEATURES_DESC_006A', 'LAT_016', 'LONG_017',
+               'YEAR_BUILT_027', 'ADT_029', 'DECK_COND_058', 'SUPERSTRUCTURE_COND_059',
+               'SUBSTRUCTURE_COND_060', 'CHANNEL_COND_061', 'CULVERT_COND_062', 'SCOUR_CRITICAL_113']
+NBI_WIDTH = 123
+
+# Storm event types & how often each occurs
+EVENT_TYPES = {'Thunderstorm Wind': 0.30, 'Hail': 0.20, 'Flash Flood': 0.10, 'Flood': 0.08,
+               'Heavy Rain': 0.07, 'Tornado': 0.05, 'High Wind': 0.05, 'Winter Storm': 0.04,
+               'Rip Current': 0.03, 'Storm Surge/Tide': 0.02, 'Tropical Storm': 0.02,
+               'Coastal Flood': 0.02, 'Hurricane (Typhoon)': 0.01, 'Drought': 0.01}
+
+# Columns of an NCEI storm event details file
+NCEI_COLUMNS = ['BEGIN_YEARMONTH', 'BEGIN_DAY', 'BEGIN_TIME', 'END_YEARMONTH', 'END_DAY', 'END_TIME',
+                'EPISODE_ID', 'EVENT_ID', 'STATE', 'STATE_FIPS', 'YEAR', 'MONTH_NAME', 'EVENT_TYPE',
+                'CZ_TYPE', 'CZ_FIPS', 'CZ_NAME', 'WFO', 'INJURIES_DIRECT', 'DEATHS_DIRECT',
+                'DAMAGE_PROPERTY', 'MAGNITUDE', 'BEGIN_LAT', 'BEGIN_LON', 'EPISODE_NARRATIVE',
+                'EVENT_NARRATIVE', 'DATA_SOURCE']
+MONTHS = np.array(['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August',
+                   'September', 'October', 'November', 'December'])
+
+
+def state_counties(state, n_counties):
+    # A function that lays a state's counties out as a grid of rectangles in the state's
+    #  box. Returns a DataFrame of county fips (odd numbers, as most are) & bounds
+    abbr, fips, lat, lon = state
+    cols = int(np.ceil(np.sqrt(n_counties)))
+    rows = int(np.ceil(n_counties / cols))
+    height, width = STATE_BOX[0] / rows, STATE_BOX[1] / cols
+    i = np.arange(n_counties)
+    south = lat - STATE_BOX[0] / 2 + (i // cols) * height
+    west = lon - STATE_BOX[1] / 2 + (i % cols) * width
+    return pd.DataFrame({'STATE': abbr, 'STATE_FIPS': fips, 'COUNTY': 2 * i + 1,
+                         'COASTAL': i < max(1, int(round(n_counties * COASTAL_SHARE))),
+                         'SOUTH': south, 'NORTH': south + height, 'WEST': west, 'EAST': west + width})
+
+def state_bridges(state, counties, n_bridges, last_year, rng):
+    # A function that makes a state's bridge inventory: structure number, county, location,
+    #  year built & removed, and what each bridge carries ratings for
+    n = n_bridges
+    bridges = pd.DataFrame({'ID': np.arange(1, n + 1)})
+    county = rng.integers(0, len(counties), n)
+    bridges['COUNTY'] = counties['COUNTY'].to_numpy()[county]
+
+    # Place each bridge in its county, except a few recorded in the wrong one
+    misplaced = rng.random(n) < 0.01
+    cell = np.where(misplaced, rng.integers(0, len(counties), n), county)
+    bridges['LAT'] = rng.uniform(counties['SOUTH'].to_numpy()[cell], counties['NORTH'].to_numpy()[cell])
+    bridges['LON'] = rng.uniform(counties['WEST'].to_numpy()[cell], counties['EAST'].to_numpy()[cell])
+
+    # Years built lean towards the post-war building boom, a few bridges are replaced
+    built = 1900 + np.round(rng.beta(3, 2, n) * (last_year - 1900))
+    bridges['BUILT'] = built.astype('int64')
+    bridges['REMOVED'] = np.where(rng.random(n) < 0.05, rng.integers(1990, last_year + 2, n), 9999)
+
+    # Culverts are rated by CULVERT_COND_062 only; channels & scour don't apply everywhere
+    bridges['CULVERT'] = rng.random(n) < 0.15
+    bridges['NO_CHANNEL'] = rng.random(n) < 0.3
+    bridges['SCOUR'] = rng.choice(np.array(['N', 'U', 'T', '3', '5', '7', '8', '9']), n,
+                                  p=[0.2, 0.05, 0.02, 0.03, 0.1, 0.3, 0.2, 0.1])
+
+    # Each bridge's ratings sit a little above or below the typical rating for its age
+    bridges[['DECK', 'SUPER', 'SUB', 'CHANNEL', 'CULV']] = rng.normal(0, 0.8, (n, 5))
+
+    # Structure numbers: 15 digits, NC's in the format 010 converts its early files to
+    left = bridges['ID'] // 1000 + 10
+    right = (bridges['ID'] % 1000).astype(str).str.zfill(3)
+    if state[0] == 'NC':
+        bridges['STRUCTURE'] = (left.astype(str) + '0' + right).str.zfill(15)
+        bridges['OLD_STRUCTURE'] = left.astype(str) + right
+    else:
+        bridges['STRUCTURE'] = bridges['ID'].astype(str).str.zfill(15)
+    return bridges
+
+def to_dms(values, width):
+    # A function that formats decimal degrees as NBI degrees, minutes & seconds (DDMMSSss)
+    values = np.abs(values)
+    degrees = np.floor(values)
+    minutes = np.floor((values - degrees) * 60)
+    hundredths = np.floor(((values - degrees) * 60 - minutes) * 6000)
+    return pd.Series((degrees * 1e6 + minutes * 1e4 + hundredths).astype('int64')).astype(str).str.zfill(width)
+
+def blank(series, share, rng):
+    # A function that blanks out a share of a string column's values
+    series = series.copy()
+    series[rng.random(len(series)) < share] = ''
+    return series
+
+def nbi_year(state, bridges, year, rng):
+    # A function that returns a state's NBI file for a year as lines of text
+    present = bridges[(bridges['BUILT'] <= year) & (bridges['REMOVED'] > year)].reset_index(drop=True)
+    n = len(present)
+
+    def rating(offset):
+        # Ratings fall about a point every 12 years, with a little year to year noise
+        value = 9 - (year - present['BUILT']) / 12 + present[offset] + rng.normal(0, 0.3, n)
+        return pd.Series(np.clip(np.round(value), 0, 9).astype('int64')).astype(str)
+
+    culvert = present['CULVERT'].to_numpy()
+    structure = present['STRUCTURE']
+    if state[0] == 'NC' and year < 2000:
+        structure = present['OLD_STRUCTURE']
+    nbi = pd.DataFrame({
+        'STATE_CODE_001': '%02d' % state[1],
+        'STRUCTURE_NUMBER_008': structure,
+        'RECORD_TYPE_005A': '1',
+        'ROUTE_PREFIX_005B': rng.integers(1, 9, n).astype(str),
+        'COUNTY_CODE_003': present['COUNTY'].astype(str).str.zfill(3),
+        'PLACE_CODE_004': '00000',
+        'FEATURES_DESC_006A': '"CREEK, TRIBUTARY ' + present['ID'].astype(str) + '"',
+        'LAT_016': blank(to_dms(present['LAT'].to_numpy(), 8), 0.01, rng),
+        'LONG_017': blank(to_dms(present['LON'].to_numpy(), 9), 0.01, rng),
+        'YEAR_BUILT_027': present['BUILT'].astype(str),
+        'ADT_029': rng.integers(10, 50000, n).astype(str),
+        'DECK_COND_058': rating('DECK').where(~culvert, 'N'),
+        'SUPERSTRUCTURE_COND_059': rating('SUPER').where(~culvert, 'N'),
+        'SUBSTRUCTURE_COND_060': rating('SUB').where(~culvert, 'N'),
+        'CHANNEL_COND_061': rating('CHANNEL').where(~present['NO_CHANNEL'].to_numpy(), 'N'),
+        'CULVERT_COND_062': rating('CULV').where(culvert, 'N'),
+        'SCOUR_CRITICAL_113': present['SCOUR'],
+    })
+    nbi['DECK_COND_058'] = blank(nbi['DECK_COND_058'], 0.01, rng)
+
+    # The rest of the record is the same filler for every bridge
+    filler = ''.join(',%d' % (i % 10) for i in range(NBI_WIDTH - len(NBI_COLUMNS)))
+    lines = nbi[NBI_COLUMNS[0]].str.cat(nbi[NBI_COLUMNS[1:]], sep=',') + filler
+    header = ','.join(NBI_COLUMNS + ['ITEM_%03d' % i for i in range(NBI_WIDTH - len(NBI_COLUMNS))])
+    return [header] + lines.tolist()
+
+def write_nbi(root, states, counties, first_year, n_years, n_bridges, rng):
+    # A function that writes every state's NBI file for every year
+    last_year = first_year + n_years - 1
+    for state in states:
+        bridges = state_bridges(state, counties[state[0]], n_bridges, last_year, rng)
+        for year in range(first_year, last_year + 1):
+            directory = os.path.join(root, 'input/nbi_files/%dhwybronefiledel' % year)
+            os.makedirs(directory, exist_ok = True)
+            with open(os.path.join(directory, '%s%s.txt' % (state[0], str(year)[2:])), 'w') as file:
+                file.write('\n'.join(nbi_year(state, bridges, year, rng)) + '\n')
+
+def zone_table(states, counties):
+    # A function that assigns forecast zones to counties: one zone per county, with every
+    #  other zone also covering the next county. Returns the rows of the zone/county file
+    rows = []
+    for state in states:
+        county_list = counties[state[0]]
+        n = len(county_list)
+        for i, county in enumerate(county_list.itertuples()):
+            covered = [county] + ([county_list.iloc[i + 1]] if i % 2 == 0 and i + 1 < n else [])
+            for c in covered:
+                rows.append({'STATE': state[0], 'ZONE': '%03d' % (i + 1), 'CWA': 'XXX',
+                             'NAME': 'Zone %d' % (i + 1), 'STATE_ZONE': '%s%03d' % (state[0], i + 1),
+                             'COUNTY': 'County %d' % c.COUNTY, 'FIPS': '%02d%03d' % (state[1], c.COUNTY),
+                             'TIME_ZONE': 'E', 'FE_AREA': 'se',
+                             'LAT': '%.4f' % ((c.SOUTH + c.NORTH) / 2), 'LON': '%.4f' % ((c.WEST + c.EAST) / 2)})
+    return pd.DataFrame(rows)
+
+def write_reference(root, states, counties):
+    # A function that writes the coastal county list, the NWS zone/county file (in its
+    #  pipe separated dbx form & as state_zone.csv) and the county boundaries
+    all_counties = pd.concat([counties[state[0]] for state in states], ignore_index=True)
+    coastal = all_counties[all_counties['COASTAL'] & (all_counties['STATE'] != INLAND_STATE[0])]
+    pd.DataFrame({'statefips': coastal['STATE_FIPS'].map('%02d'.__mod__),
+                  'stateusps': coastal['STATE'],
+                  'countyfips': coastal['STATE_FIPS'].map('%02d'.__mod__) + coastal['COUNTY'].map('%03d'.__mod__),
+                  'countyname': 'County ' + coastal['COUNTY'].astype(str)}
+                 ).to_csv(os.path.join(root, 'input/Coastal_Counties.csv'), index=False)
+
+    zones = zone_table(states, counties)
+    zones.to_csv(os.path.join(root, 'input/bp05mr24.dbx'), sep='|', header=False, index=False)
+    zones.to_csv(os.path.join(root, 'input/state_zone.csv'), index=False)
+
+    boundaries = gpd.GeoDataFrame(
+        {'STATEFP': all_counties['STATE_FIPS'].map('%02d'.__mod__),
+         'COUNTYFP': all_counties['COUNTY'].map('%03d'.__mod__),
+         'NAME': 'County ' + all_counties['COUNTY'].astype(str)},
+        geometry=shapely.box(all_counties['WEST'], all_counties['SOUTH'],
+                             all_counties['EAST'], all_counties['NORTH']), crs='epsg:4269')
+    boundaries.to_file(os.path.join(root, 'input/cb_us_county_500k.shp'))
+    return zones
+
+def write_storms(root, states, counties, zones, first_year, n_years, n_events, rng):
+    # A function that writes an NCEI storm event details file for each year. Events are
+    #  recorded by county (C), forecast zone (Z) or marine zone (M); some are in inland
+    #  counties & zones the pipeline drops. Like real marine records, M events carry a
+    #  marine area as their STATE & STATE_FIPS (the pipeline drops them too)
+    event_names = np.array(list(EVENT_TYPES))
+    event_shares = np.array(list(EVENT_TYPES.values()))
+    zone_numbers = {state[0]: zones.loc[zones['STATE'] == state[0], 'ZONE'].unique().astype(int)
+                    for state in states}
+    event_id = 0
+    for year in range(first_year, first_year + n_years):
+        n = n_events
+        state = rng.integers(0, len(states), n)
+        cz_type = rng.choice(np.array(['C', 'Z', 'M']), n, p=[0.45, 0.5, 0.05])
+        cz_fips = np.empty(n, dtype='int64')
+        for i, (abbr, _, _, _) in enumerate(states):
+            rows = np.flatnonzero(state == i)
+            county = rng.choice(counties[abbr]['COUNTY'].to_numpy(), rows.size)
+            zone = rng.choice(zone_numbers[abbr], rows.size)
+            cz_fips[rows] = np.where(cz_type[rows] == 'C', county,
+                                     np.where(cz_type[rows] == 'Z', zone, rng.integers(30, 90, rows.size)))
+        marine = cz_type == 'M'
+        month = rng.integers(1, 13, n)
+        storms = pd.DataFrame({
+            'BEGIN_YEARMONTH': year * 100 + month, 'BEGIN_DAY': rng.integers(1, 29, n),
+            'BEGIN_TIME': rng.integers(0, 2400, n), 'END_YEARMONTH': year * 100 + month,
+            'END_DAY': rng.integers(1, 29, n), 'END_TIME': rng.integers(0, 2400, n),
+            'EPISODE_ID': event_id // 4 + np.arange(n) // 4, 'EVENT_ID': event_id + np.arange(n),
+            'STATE': np.array([s[0] for s in states])[state],
+            'STATE_FIPS': np.array([s[1] for s in states])[state],
+            'YEAR': year, 'MONTH_NAME': MONTHS[month - 1],
+            'EVENT_TYPE': rng.choice(event_names, n, p=event_shares / event_shares.sum()),
+            'CZ_TYPE': cz_type, 'CZ_FIPS': cz_fips, 'CZ_NAME': 'AREA ' + pd.Series(cz_fips).astype(str),
+            'WFO': 'XXX', 'INJURIES_DIRECT': rng.poisson(0.05, n), 'DEATHS_DIRECT': rng.poisson(0.01, n),
+            'DAMAGE_PROPERTY': np.where(rng.random(n) < 0.5, '0.00K', '10.00K'),
+            'MAGNITUDE': np.round(rng.uniform(0, 80, n), 1),
+            'BEGIN_LAT': np.round(rng.uniform(25, 48, n), 4), 'BEGIN_LON': np.round(rng.uniform(-124, -67, n), 4),
+            'EPISODE_NARRATIVE': 'A line of storms moved across the area, producing damaging winds.',
+            'EVENT_NARRATIVE': 'Trees and power lines were reported down, several roads were closed.',
+            'DATA_SOURCE': 'CSV'})
+        area = cz_fips[marine] % len(MARINE_AREAS)
+        storms.loc[marine, 'STATE'] = np.array([a[0] for a in MARINE_AREAS])[area]
+        storms.loc[marine, 'STATE_FIPS'] = np.array([a[1] for a in MARINE_AREAS])[area]
+        event_id += n
+        storms[NCEI_COLUMNS].to_csv(os.path.join(
+            root, 'input/noaa_data/StormEvents_details-ftp_v1.0_d%d_c20240116.csv' % year), index=False)
+
+def write_census(root, states, counties, rng):
+    # A function that writes county population estimates for 2010-2019 & 2020-2021 in
+    #  the layout of the Census co-est*-alldata files, with a total row for each state
+    all_counties = pd.concat([counties[state[0]] for state in states], ignore_index=True)
+    population = rng.lognormal(10.5, 1.2, len(all_counties)).astype('int64') + 500
+    growth = rng.normal(0.005, 0.01, len(all_counties))
+    estimates = {year: (population * (1 + growth) ** (year - 2010)).astype('int64') for year in range(2010, 2022)}
+
+    for name, years in [('co-est2019-alldata.csv', range(2010, 2020)), ('co-est2021-alldata.csv', range(2020, 2022))]:
+        census = pd.DataFrame({'SUMLEV': 50, 'REGION': 3, 'DIVISION': 5,
+                               'STATE': all_counties['STATE_FIPS'], 'COUNTY': all_counties['COUNTY'],
+                               'STNAME': all_counties['STATE'],
+                               'CTYNAME': 'County ' + all_counties['COUNTY'].astype(str)})
+        for year in years:
+            census['POPESTIMATE%d' % year] = estimates[year]
+        totals = census.groupby(['STATE', 'STNAME'], as_index=False)[['POPESTIMATE%d' % y for y in years]].sum()
+        totals = totals.assign(SUMLEV=40, REGION=3, DIVISION=5, COUNTY=0, CTYNAME=totals['STNAME'])
+        census = pd.concat([totals[census.columns], census]).sort_values(['STATE', 'COUNTY'], kind='stable')
+        census.to_csv(os.path.join(root, 'input/census', name), index=False, encoding='latin-1')
+
+def generate(root, states=4, counties=10, bridges=2000, first_year=1996, years=8, events=20000, seed=0):
+    # A function that writes a full set of synthetic inputs under root. Sizes are per
+    #  state (counties, bridges) & per year (events). The storm history ends with the last
+    #  NBI year & covers at least 12 years, as 060 only fits counties with 10 or more
+    #  years of events. Returns a summary of what was written
+    storm_years = max(years, 12)
+    rng = np.random.default_rng(seed)
+    selected = COASTAL_STATES[:states] + [INLAND_STATE]
+    for directory in ['input/nbi_files', 'input/noaa_data', 'input/census']:
+        os.makedirs(os.path.join(root, directory), exist_ok = True)
+
+    county_grids = {state[0]: state_counties(state, counties) for state in selected}
+    zones = write_reference(root, selected, county_grids)
+    write_nbi(root, selected, county_grids, first_year, years, bridges, rng)
+    write_storms(root, selected, county_grids, zones, first_year + years - storm_years, storm_years, events, rng)
+    write_census(root, selected, county_grids, rng)
+    return {'states': states, 'counties': counties, 'bridges': bridges, 'first_year': first_year,
+            'years': years, 'events': events, 'seed': seed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write synthetic pipeline inputs')
+    parser.add_argument('folder', help='folder to write input/ under')
+    parser.add_argument('--states', type=int, default=4, choices=range(1, len(COASTAL_STATES) + 1),
+                        metavar='N', help='coastal states (plus one inland state)')
+    parser.add_argument('--counties', type=int, default=10, help='counties per state')
+    parser.add_argument('--bridges', type=int, default=2000, help='bridges per state')
+    parser.add_argument('--first-year', type=int, default=1996, help='first NBI & NCEI year')
+    parser.add_argument('--years', type=int, default=8, help='number of years')
+    parser.add_argument('--events', type=int, default=20000, help='storm events per year')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    scale = generate(args.folder, args.states, args.counties, args.bridges, args.first_year,
+                     args.years, args.events, args.seed)
+    print('Wrote synthetic inputs to %s: %s' % (args.folder, scale))
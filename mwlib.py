@@ -1,4 +1,73 @@
 import os
+import time
+import json
+import inspect
+import resource
+import functools
+import contextlib
+import pickle
+import hashlib
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import geopandas as gpd
+import numpy as np
+import scipy.stats as stats
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+import shapely
+
+# Number of worker processes used by the stages that support a parallel mode.
+#  Set CB_WORKERS in the environment to override (1 runs everything serially)
+WORKERS = int(os.environ.get('CB_WORKERS', '1'))
+
+# File format for the tables handed from one stage to the next ('parquet', 'feather'
+#  or 'csv'). Set CB_CSV_EXPORT=1 to also write a CSV copy of every table
+TABLE_FORMAT = os.environ.get('CB_TABLE_FORMAT', 'parquet')
+CSV_EXPORT = os.environ.get('CB_CSV_EXPORT', '0') == '1'
+TABLE_EXTS = {'parquet': '.parquet', 'feather': '.feather', 'csv': '.csv'}
+
+# Identifier & code columns read from CSV tables as strings, so codes such as a state
+#  fips of '01' keep their leading zeros
+CSV_STRING_COLUMNS = ['STATE_STR', 'ST_CNTY', 'STATE', 'STATE_CODE_001', 'COUNTY_CODE_003',
+                      'STRUCTURE_NUMBER_008', 'STATE_CZ', 'COUNTY_FOUND']
+
+# File format for the GIS outputs (e.g. shape_files/bridge_ages): 'gpkg' (GeoPackage),
+#  'fgb' (FlatGeobuf), 'parquet' (GeoParquet) or 'shp' (ESRI Shapefile). GeoPackage &
+#  FlatGeobuf are written with a spatial index. Set CB_SPATIAL_FORMAT to override
+SPATIAL_FORMAT = os.environ.get('CB_SPATIAL_FORMAT', 'gpkg')
+SPATIAL_EXTS = {'gpkg': '.gpkg', 'fgb': '.fgb', 'parquet': '.parquet', 'shp': '.shp'}
+
+# Folder holding the manifests of what each stage last built. Set CB_FORCE=1 to
+#  rebuild everything regardless of the manifests
+MANIFEST_DIR = 'output/manifest/'
+FORCE = os.environ.get('CB_FORCE', '0') == '1'
+
+# Set CB_VALIDATE=1 to also run the statsmodels fits the batched trend functions
+#  replace, and report the largest difference between the two
+VALIDATE = os.environ.get('CB_VALIDATE', '0') == '1'
+
+# Reference files shared by the stages & the folder their parsed, cached form is kept in
+COASTAL_FILE = 'input/Coastal_Counties.csv'
+ZONE_FILE = 'input/bp05mr24.dbx'
+STATE_ZONE_FILE = 'input/state_zone.csv'
+REFERENCE_DIR = 'output/reference/'
+
+# Folder the step timings of each stage are written to (<stage>_timings.csv) & the
+#  columns recorded for each timed step
+LOG_DIR = 'output/logs/'
+TIMING_COLUMNS = ['step', 'state', 'year', 'seconds', 'rows_in', 'rows_out', 'peak_rss_mb', 'pid']
+
+# Timed steps of this process not yet written to the stage's timings file, & the
+#  steps currently running (innermost last)
+TIMINGS = []
+RUNNING_STEPS = []
+
+# Node capacity of the spatial index (STRtree) built over each yearly bridge table's
+#  points & the earth radius used by radius & nearest queries (km)
+INDEX_NODE_SIZE = 64
+EARTH_RADIUS_KM = 6371.0088
 
 def get_files(directory, ext):
     # A function that returns a list of files in the specified directory
@@ -22,3 +91,711 @@ def get_drop_columns(col_names, columns_to_keep):
         if i not in columns_to_keep:
                 columns_to_drop.append(i)
     return columns_to_drop
+
+def row_count(value):
+    # A function that returns the number of rows of a DataFrame/Series (or of the first
+    #  item of a tuple, e.g. a DataFrame & some counts), None for anything else
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    return None
+
+def frame_mb(df):
+    # A function that returns the memory a DataFrame takes, including its strings (MB)
+    return df.memory_usage(deep=True).sum() / 1e6
+
+def peak_rss_mb():
+    # A function that returns the peak resident memory of this process so far (MB). On
+    #  Linux this is read from /proc, as getrusage carries the peak of the process that
+    #  started this one (e.g. run_pipeline.py) across exec
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+@contextlib.contextmanager
+def timed(step, state=None, year=None, rows_in=None):
+    # A context manager that times a step & buffers its record in TIMINGS. State & year
+    #  default to those of the step it runs inside. Set record['rows_out'] in the block
+    #  to record the rows it produced
+    outer = RUNNING_STEPS[-1] if RUNNING_STEPS else {}
+    record = {'step': step,
+              'state': outer.get('state', '') if state is None else state,
+              'year': outer.get('year', '') if year is None else year,
+              'rows_in': rows_in, 'rows_out': None}
+    RUNNING_STEPS.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        RUNNING_STEPS.pop()
+        record['seconds'] = time.perf_counter() - start
+        record['peak_rss_mb'] = peak_rss_mb()
+        record['pid'] = os.getpid()
+        TIMINGS.append(record)
+
+def timed_function(step=None, flush=None):
+    # A decorator that times every call of a function as a step (named after the function
+    #  by default). Its state & year arguments, the rows of its first argument & the rows
+    #  it returns are recorded. Set flush to a stage to write the timings after each call
+    #  (for functions that run in worker processes)
+    def decorate(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            first = next(iter(arguments.values()), None)
+            with timed(step or func.__name__, arguments.get('state'), arguments.get('year'),
+                       row_count(first)) as record:
+                result = func(*args, **kwargs)
+                record['rows_out'] = row_count(result)
+            if flush:
+                flush_timings(flush)
+            return result
+        return wrapper
+    return decorate
+
+def timings_path(stage):
+    # A function that returns the file a stage's step timings are written to
+    return LOG_DIR + stage + '_timings.csv'
+
+def reset_timings(stage):
+    # A function that starts a stage's step timings file afresh at the start of a run
+    os.makedirs(LOG_DIR, exist_ok=True)
+    with open(timings_path(stage), 'w') as file:
+        file.write(','.join(TIMING_COLUMNS) + '\n')
+    del TIMINGS[:]
+    return
+
+def flush_timings(stage):
+    # A function that appends the buffered step timings of this process to the stage's
+    #  timings file in one write (worker processes flush their own)
+    if not TIMINGS:
+        return
+    path = timings_path(stage)
+    header = not os.path.exists(path)
+    os.makedirs(LOG_DIR, exist_ok=True)
+    lines = pd.DataFrame(TIMINGS, columns=TIMING_COLUMNS).to_csv(index=False, header=header)
+    with open(path, 'a') as file:
+        file.write(lines)
+    del TIMINGS[:]
+    return
+
+def read_timings(stages):
+    # A function that reads the step timings of the listed stages into one DataFrame
+    frames = []
+    for stage in stages:
+        if os.path.exists(timings_path(stage)):
+            frame = pd.read_csv(timings_path(stage), dtype={'state': str, 'year': str})
+            frame.insert(0, 'stage', stage)
+            frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=['stage'] + TIMING_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+def timing_report(stages, top=10):
+    # A function that prints the steps that took the longest in total across the listed
+    #  stages (with their number of calls, slowest call & peak memory) and the slowest
+    #  single calls
+    timings = read_timings(stages)
+    if timings.empty:
+        return
+    steps = timings.groupby(['stage', 'step']).agg(
+        calls=('seconds', 'size'), total_s=('seconds', 'sum'), max_s=('seconds', 'max'),
+        rows_out=('rows_out', lambda rows: rows.sum(min_count=1)), peak_rss_mb=('peak_rss_mb', 'max'))
+    print('\nSlowest steps:')
+    print(steps.sort_values('total_s', ascending=False).head(top).round(3).to_string())
+
+    calls = timings.sort_values('seconds', ascending=False).head(top)
+    print('\nSlowest calls:')
+    print(calls[['stage', 'step', 'state', 'year', 'seconds', 'rows_in', 'rows_out', 'peak_rss_mb']]
+          .round(3).fillna('').to_string(index=False))
+    return
+
+# Zero-padded text of every 2 & 3 digit fips code, looked up by number
+PADDED_FIPS = {width: np.array([str(i).zfill(width) for i in range(10 ** width)], dtype=object)
+               for width in (2, 3)}
+
+# NCEI storm files number PR, GU & VI differently from the NBI & census (NCEI: NBI)
+NCEI_TERRITORY_FIPS = {98: 66, 96: 78, 99: 72}
+
+def pad_fips(values, width):
+    # A function that zero-pads a Series of fips codes (numbers or numeric strings) to
+    #  width characters. Each distinct code is converted once & the text comes from
+    #  PADDED_FIPS, missing codes stay missing
+    positions, uniques = pd.factorize(values)
+    numbers = pd.to_numeric(pd.Series(uniques, dtype=object)).to_numpy(dtype='int64')
+    if width in PADDED_FIPS and (numbers.size == 0 or (numbers.min() >= 0 and
+                                                       numbers.max() < PADDED_FIPS[width].size)):
+        padded = PADDED_FIPS[width][numbers]
+    else:
+        padded = np.array([str(number).zfill(width) for number in numbers], dtype=object)
+    return pd.Series(np.append(padded, None)[positions], index=values.index)
+
+def state_abbreviations(state_fips, codes, remap=None):
+    # A function that looks up the USPS abbreviation of a Series of state fips codes.
+    #  codes maps state fips (number or string) to abbreviation, remap maps other fips
+    #  onto those (e.g. NCEI_TERRITORY_FIPS). Unknown states are missing
+    lookup = np.full(100, None, dtype=object)
+    for fips, state in codes.items():
+        lookup[int(fips)] = state
+    for fips, target in (remap or {}).items():
+        lookup[fips] = lookup[target]
+
+    positions, uniques = pd.factorize(state_fips)
+    numbers = pd.to_numeric(pd.Series(uniques, dtype=object)).to_numpy(dtype='int64')
+    known = (numbers >= 0) & (numbers < lookup.size)
+    states = np.where(known, lookup[np.where(known, numbers, 0)], None)
+    return pd.Series(np.append(states, None)[positions], index=state_fips.index)
+
+def fips_key(prefix, codes, width=3):
+    # A function that builds location keys like ST_CNTY & STATE_CZ: a state prefix (a
+    #  string or Series) followed by the zero-padded county/zone fips code
+    return prefix + pad_fips(codes, width)
+
+def process_pool(workers):
+    # A function that returns a process pool for fanning out independent files.
+    #  Workers are forked so functions defined in the calling script are available
+    return ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('fork'))
+
+def parallel_map(func, *iterables, workers=WORKERS, chunksize=1):
+    # A function that maps func over the iterables (like the built-in map) and returns
+    #  a list in input order, using a process pool when more than one worker is set.
+    #  Items are sent to the workers chunksize at a time: keep 1 for slow items such as
+    #  whole files, so every worker gets some, & raise it for many small items
+    if workers <= 1:
+        return list(map(func, *iterables))
+    with process_pool(workers) as pool:
+        return list(pool.map(func, *iterables, chunksize=chunksize))
+
+def table_path(path):
+    # A function that returns the file name for a table stored without an extension,
+    #  preferring the configured format & falling back to any other format on disk
+    preferred = path + TABLE_EXTS[TABLE_FORMAT]
+    if os.path.exists(preferred):
+        return preferred
+    for ext in TABLE_EXTS.values():
+        if os.path.exists(path + ext):
+            return path + ext
+    return preferred
+
+def list_tables(directory):
+    # A function that returns a sorted list of table names (no extension) in a directory
+    ext = TABLE_EXTS[TABLE_FORMAT]
+    return sorted(i[:-len(ext)] for i in os.listdir(directory) if i.endswith(ext))
+
+@timed_function()
+def write_table(df, path):
+    # A function that writes a DataFrame/GeoDataFrame to path + the extension of the
+    #  configured format. Geometry is written as GeoParquet/GeoArrow, or WKT in CSV
+    ext = TABLE_EXTS[TABLE_FORMAT]
+    if TABLE_FORMAT == 'parquet':
+        df.to_parquet(path + ext, index=False)
+    elif TABLE_FORMAT == 'feather':
+        df.reset_index(drop=True).to_feather(path + ext)
+    if TABLE_FORMAT == 'csv' or CSV_EXPORT:
+        df.to_csv(path + '.csv', index=False)
+    return
+
+def spatial_path(path):
+    # A function that returns the file name for a GIS output stored without an extension
+    return path + SPATIAL_EXTS[SPATIAL_FORMAT]
+
+@timed_function()
+def write_spatial(gdf, path):
+    # A function that writes a GeoDataFrame to path + the extension of the configured
+    #  GIS format, replacing any earlier file
+    file = spatial_path(path)
+    if SPATIAL_FORMAT == 'parquet':
+        gdf.to_parquet(file, index=False)
+        return
+    if os.path.exists(file):
+        os.remove(file)
+    if SPATIAL_FORMAT == 'gpkg':
+        gdf.to_file(file, driver='GPKG', layer=os.path.basename(path), SPATIAL_INDEX='YES', use_arrow=True)
+    elif SPATIAL_FORMAT == 'fgb':
+        gdf.to_file(file, driver='FlatGeobuf', SPATIAL_INDEX='YES', use_arrow=True)
+    else:
+        gdf.to_file(file)
+    return
+
+def table_columns(path):
+    # A function that returns the column names of a stored table without reading its data
+    file = table_path(path)
+    if file.endswith('.parquet'):
+        return pq.read_schema(file).names
+    elif file.endswith('.feather'):
+        return ipc.open_file(file).schema.names
+    return pd.read_csv(file, nrows=0).columns.tolist()
+
+@timed_function()
+def read_table(path, columns=None):
+    # A function that reads a table written by write_table, optionally only the listed
+    #  columns. A GeoDataFrame is returned whenever the geometry column is read
+    file = table_path(path)
+    if columns is None:
+        columns = table_columns(path)
+    columns = list(columns)
+    geometry = 'geometry' in columns
+
+    if file.endswith('.parquet'):
+        if geometry:
+            return gpd.read_parquet(file, columns=columns)
+        return pd.read_parquet(file, columns=columns)
+    elif file.endswith('.feather'):
+        if geometry:
+            return gpd.read_feather(file, columns=columns)
+        return pd.read_feather(file, columns=columns)
+
+    df = pd.read_csv(file, usecols=columns, dtype=csv_dtypes(columns))[columns]
+    if geometry:
+        df = gpd.GeoDataFrame(df, geometry=gpd.GeoSeries.from_wkt(df['geometry']), crs='epsg:4326')
+    return df
+
+def csv_dtypes(columns):
+    # A function that returns the read_csv dtypes of the identifier columns among columns
+    return {column: str for column in columns if column in CSV_STRING_COLUMNS}
+
+def bridge_points(df, x='LONG_DEC', y='LAT_DEC'):
+    # A function that returns a DataFrame as a GeoDataFrame of points built from its
+    #  longitude & latitude columns in one vectorized call (no per-row geometry parsing)
+    return gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df[x], df[y]), crs='epsg:4326')
+
+def file_hash(path):
+    # A function that returns the sha256 hash of a file's contents
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def code_version(script):
+    # A function that returns a hash of a stage script & this library, so a stage
+    #  is re-run whenever its logic changes
+    digest = hashlib.sha256()
+    for path in [script, os.path.abspath(__file__)]:
+        digest.update(file_hash(path).encode())
+    return digest.hexdigest()
+
+def load_manifest(stage):
+    # A function that loads the manifest for a stage (or an empty one)
+    path = MANIFEST_DIR + stage + '.json'
+    if not os.path.exists(path):
+        return {'files': {}, 'entries': {}}
+    with open(path) as file:
+        return json.load(file)
+
+def save_manifest(stage, manifest):
+    # A function that writes a stage's manifest (via a temporary file so an
+    #  interrupted run never leaves a partial manifest)
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    path = MANIFEST_DIR + stage + '.json'
+    with open(path + '.tmp', 'w') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+    return
+
+def file_signature(manifest, path):
+    # A function that returns the hash of a file, reusing the hash recorded in the
+    #  manifest when the file's size & modification time are unchanged
+    if not os.path.exists(path):
+        return None
+    info = os.stat(path)
+    cached = manifest['files'].get(path)
+    if cached and cached['size'] == info.st_size and cached['mtime'] == info.st_mtime_ns:
+        return cached['sha256']
+    sha = file_hash(path)
+    manifest['files'][path] = {'size': info.st_size, 'mtime': info.st_mtime_ns, 'sha256': sha}
+    return sha
+
+def is_current(manifest, key, inputs, outputs, code):
+    # A function that checks whether the outputs recorded under key were built from the
+    #  same inputs & code and are still on disk unchanged
+    entry = manifest['entries'].get(key)
+    if FORCE or entry is None or entry['code'] != code:
+        return False
+    if entry['inputs'] != {path: file_signature(manifest, path) for path in sorted(inputs)}:
+        return False
+    return entry['outputs'] == {path: file_signature(manifest, path) for path in sorted(outputs)}
+
+def record(manifest, key, inputs, outputs, code):
+    # A function that records the inputs, outputs & code version used to build key
+    manifest['entries'][key] = {'code': code,
+                                'inputs': {path: file_signature(manifest, path) for path in sorted(inputs)},
+                                'outputs': {path: file_signature(manifest, path) for path in sorted(outputs)}}
+    return
+
+def stage_is_current(stage, inputs, outputs, script):
+    # A function that checks whether a whole stage can be skipped
+    return is_current(load_manifest(stage), stage, inputs, outputs, code_version(script))
+
+def record_stage(stage, inputs, outputs, script):
+    # A function that records a successful run of a whole stage
+    manifest = load_manifest(stage)
+    record(manifest, stage, inputs, outputs, code_version(script))
+    save_manifest(stage, manifest)
+    return
+
+@timed_function()
+def read_yearly(directory, columns):
+    # A function that reads the listed columns of every yearly table (outYYYY) in a
+    #  directory into one long-format DataFrame with a YEAR column. Each year keeps
+    #  the row index of its own file
+    frames = []
+    for name in list_tables(directory):
+        df = read_table(directory + name, columns)
+        df['YEAR'] = name[-4:]
+        frames.append(df)
+    return pd.concat(frames)
+
+@timed_function()
+def pivot_years(yearly, attribute, years, key='STATE_STR'):
+    # A function that pivots one attribute of a long-format yearly DataFrame into a wide
+    #  layout with one row per key and one column per year (first record of a key wins).
+    #  Nullable integers (e.g. Int8 ratings) come back as floats with NaN, float32 for 1 &
+    #  2 byte integers, so the years stay one 2-D block that row-wise steps work on quickly
+    values = yearly.drop_duplicates([key, 'YEAR'], keep='first')
+    wide = values.pivot(index=key, columns='YEAR', values=attribute).reindex(columns=years)
+    dtype = yearly[attribute].dtype
+    if pd.api.types.is_extension_array_dtype(dtype) and pd.api.types.is_integer_dtype(dtype):
+        wide = wide.astype('float32' if dtype.itemsize <= 2 else 'float64')
+    wide.columns.name = None
+    return wide.reset_index()
+
+def cube_files(path):
+    # A function that returns the files of a bridge cube stored at path (no extension):
+    #  the values array, its axes (years & attributes) & the bridge index table
+    return [path + '.npy', path + '.json', table_path(path + '_index')]
+
+@timed_function()
+def create_cube(path, index, years, attributes, dtype='float64'):
+    # A function that starts a bridge x year x attribute cube on disk: writes the index
+    #  (one row per bridge, STATE_STR first) & the axes, and returns the values as a
+    #  writable memory-mapped array filled with NaN. Float64 by default, so continuous
+    #  attributes such as MEAN_RATING keep their full precision. Values are stored
+    #  attribute by attribute, shape (attributes, bridges, years), so reading one
+    #  attribute or a range of years only touches that part of the file
+    write_table(index.reset_index(drop=True), path + '_index')
+    with open(path + '.json', 'w') as file:
+        json.dump({'years': list(years), 'attributes': list(attributes)}, file)
+    values = np.lib.format.open_memmap(path + '.npy', mode='w+', dtype=dtype,
+                                       shape=(len(attributes), len(index), len(years)))
+    values[:] = np.nan
+    return values
+
+def open_cube(path, index_columns=None):
+    # A function that opens a bridge cube written with create_cube without reading its
+    #  values: returns the index table (optionally only the listed columns), years,
+    #  attributes & the read-only memory-mapped values
+    with open(path + '.json') as file:
+        axes = json.load(file)
+    return {'index': read_table(path + '_index', index_columns),
+            'years': axes['years'],
+            'attributes': axes['attributes'],
+            'values': np.load(path + '.npy', mmap_mode='r')}
+
+@timed_function()
+def cube_slice(cube, attribute, first=None, last=None, bridges=slice(None)):
+    # A function that reads one attribute of a bridge cube for the years from first to
+    #  last (inclusive, default all) into memory, optionally for a slice of the bridges.
+    #  Returns a 2-D array (bridges x years) & the list of years it covers
+    years = cube['years']
+    start = 0 if first is None else years.index(str(first))
+    stop = len(years) if last is None else years.index(str(last)) + 1
+    values = cube['values'][cube['attributes'].index(attribute), bridges, start:stop]
+    return np.array(values), years[start:stop]
+
+@timed_function()
+def ols_trend(values, x):
+    # A function that fits a least-squares line through every row of a 2-D array at once.
+    #  NaN values are left out of their row's fit. Returns the slope, intercept, standard
+    #  error of the slope, r squared & number of points used for each row (NaN where a
+    #  row has too few points)
+    y = np.asarray(values, dtype='float64')
+    x = np.broadcast_to(np.asarray(x, dtype='float64'), y.shape)
+    mask = ~np.isnan(y)
+    y0 = np.where(mask, y, 0.0)
+    x0 = np.where(mask, x, 0.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        n = mask.sum(axis=1)
+        x_mean = x0.sum(axis=1) / n
+        y_mean = y0.sum(axis=1) / n
+        dx = np.where(mask, x - x_mean[:, None], 0.0)
+        dy = np.where(mask, y - y_mean[:, None], 0.0)
+        sxx = (dx * dx).sum(axis=1)
+        sxy = (dx * dy).sum(axis=1)
+        syy = (dy * dy).sum(axis=1)
+
+        slope = sxy / sxx
+        intercept = y_mean - slope * x_mean
+        sse = np.maximum(syy - slope * sxy, 0.0)
+        std_err = np.sqrt(sse / (n - 2) / sxx)
+        r_squared = 1.0 - sse / syy
+
+    slope[n < 2] = np.nan
+    intercept[n < 2] = np.nan
+    std_err[n < 3] = np.nan
+    return pd.DataFrame({'slope': slope, 'intercept': intercept, 'std_err': std_err,
+                         'r_squared': r_squared, 'n': n})
+
+@timed_function()
+def poisson_trend(counts, x, max_iter=100, tol=1e-8):
+    # A function that fits a Poisson regression log(mu) = a + b*x through every row of a
+    #  2-D array of counts at once, using iteratively reweighted least squares on all rows
+    #  together. NaN values are left out of their row's fit. Returns the slope & its Wald
+    #  p-value for each row (NaN where a row has fewer than two points)
+    y = np.asarray(counts, dtype='float64')
+    x = np.asarray(x, dtype='float64')
+    x = np.broadcast_to(x - x.mean(), y.shape)
+    mask = ~np.isnan(y)
+    y = np.where(mask, y, 0.0)
+    n = mask.sum(axis=1)
+
+    def normal_equations(w, z):
+        # Weighted sums forming each row's 2x2 least squares problem
+        w = np.where(mask, w, 0.0)
+        return ((w).sum(axis=1), (w * x).sum(axis=1), (w * x * x).sum(axis=1),
+                (w * z).sum(axis=1), (w * x * z).sum(axis=1))
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        # Start from the same point as statsmodels: mu = (y + mean(y)) / 2
+        y_mean = y.sum(axis=1) / n
+        mu = np.where(mask, (y + y_mean[:, None]) / 2, 1.0)
+        eta = np.log(mu)
+        intercept = np.zeros(len(y))
+        slope = np.zeros(len(y))
+        deviance = np.full(len(y), np.inf)
+        active = n >= 2
+
+        for _ in range(max_iter):
+            # Weighted least squares on the working response
+            s0, s1, s2, t0, t1 = normal_equations(mu, eta + (y - mu) / mu)
+            det = s0 * s2 - s1 * s1
+            new_slope = (s0 * t1 - s1 * t0) / det
+            new_intercept = (t0 - new_slope * s1) / s0
+
+            # Only update rows that haven't converged yet
+            slope = np.where(active, new_slope, slope)
+            intercept = np.where(active, new_intercept, intercept)
+            eta = intercept[:, None] + slope[:, None] * x
+            mu = np.exp(eta)
+
+            # Stop each row once its Poisson deviance stops changing
+            term = np.where(y > 0, y * np.log(y / mu), 0.0) - (y - mu)
+            new_deviance = 2 * np.where(mask, term, 0.0).sum(axis=1)
+            converged = np.abs(new_deviance - deviance) <= tol * (np.abs(new_deviance) + 0.1)
+            deviance = np.where(active, new_deviance, deviance)
+            active = active & ~converged
+            if not active.any():
+                break
+
+        # Standard error of the slope from the Fisher information of the fitted model
+        s0, s1, s2, _, _ = normal_equations(mu, eta)
+        std_err = np.sqrt(s0 / (s0 * s2 - s1 * s1))
+        p_value = 2 * stats.norm.sf(np.abs(slope / std_err))
+
+    slope[n < 2] = np.nan
+    p_value[n < 2] = np.nan
+    return pd.DataFrame({'slope': slope, 'p_value': p_value, 'n': n})
+
+@timed_function()
+def rating_summary(values, rated=None, mean=False, weights=None):
+    # A function that summarizes every row of a 2-D array of ratings at once: the number
+    #  of ratings, their geometric mean (from the mean of their logs, so no product of
+    #  ratings is formed to overflow or lose precision) & the lowest rating. Optionally
+    #  adds the arithmetic mean & weighted means (weights: {name: a weight per column}).
+    #  Entries where rated is False (by default NaN values) are left out; rows without a
+    #  rating get NaN. Returns a DataFrame with a row for each row of values
+    values = np.asarray(values)
+    if rated is None:
+        rated = ~np.isnan(values)
+    x = np.where(rated, values, 0).astype('float64')
+    n = rated.sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # A rating of 0 has a log of -inf & gives a geometric mean of 0
+        logs = np.log(x, out=np.zeros_like(x), where=rated)
+        summary = {'count': n,
+                   'geometric_mean': np.exp(logs.sum(axis=1) / n),
+                   'lowest': np.where(rated, x, np.inf).min(axis=1)}
+        if mean:
+            summary['mean'] = x.sum(axis=1) / n
+        for name, weight in (weights or {}).items():
+            weight = np.asarray(weight, dtype='float64')
+            summary[name] = (x * weight).sum(axis=1) / (rated * weight).sum(axis=1)
+
+    summary['lowest'][n == 0] = np.nan
+    return pd.DataFrame(summary)
+
+def iter_table(path, columns, chunk_rows=100000):
+    # A function that reads a stored table in chunks of rows (only the listed columns) so
+    #  tables larger than memory can be processed one piece at a time
+    file = table_path(path)
+    if file.endswith('.parquet'):
+        for batch in pq.ParquetFile(file).iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+    elif file.endswith('.feather'):
+        # Read the file's record batches one at a time from a memory map
+        with pa.memory_map(file) as source:
+            reader = ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i).select(columns)
+                for start in range(0, batch.num_rows, chunk_rows):
+                    yield batch.slice(start, chunk_rows).to_pandas()
+    else:
+        for chunk in pd.read_csv(file, usecols=columns, dtype=csv_dtypes(columns), chunksize=chunk_rows):
+            yield chunk[columns]
+
+def cached_reference(name, sources, build):
+    # A function that returns build(), the parsed form of some reference files, from a
+    #  pickle in REFERENCE_DIR when it was built from the same file contents & this
+    #  library's code, & otherwise builds it & saves it for the next stage
+    key = [file_hash(source) for source in sources] + [file_hash(os.path.abspath(__file__))]
+    path = REFERENCE_DIR + name + '.pkl'
+    if os.path.exists(path):
+        with open(path, 'rb') as file:
+            cached = pickle.load(file)
+        if cached['key'] == key:
+            return cached['data']
+
+    data = build()
+
+    # Stages run at the same time, so write to a file of this process's own first
+    os.makedirs(REFERENCE_DIR, exist_ok=True)
+    with open(path + '.%d.tmp' % os.getpid(), 'wb') as file:
+        pickle.dump({'key': key, 'data': data}, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.%d.tmp' % os.getpid(), path)
+    return data
+
+def coastal_locations():
+    # A function that returns the coastal counties file as lookups: 'states' & 'counties'
+    #  (arrays of the coastal state abbreviations & 5 digit county fips) and
+    #  'state_codes' (state fips: abbreviation, keyed by the fips as a string)
+    def build():
+        coastal = pd.read_csv(COASTAL_FILE, dtype=str)
+        codes = coastal.drop_duplicates(subset=['statefips'], keep='first')
+        return {'states': coastal['stateusps'].unique().copy(),
+                'counties': coastal['countyfips'].unique().copy(),
+                'state_codes': dict(zip(codes['statefips'].astype(int).astype(str), codes['stateusps']))}
+    return cached_reference('coastal_counties', [COASTAL_FILE], build)
+
+def forecast_zones():
+    # A function that returns the relationship between coastal counties & NWS forecast
+    #  zones: 'zones' (a DataFrame of ST_ZONE, CNTY_FIPS & ST_CNTY with a row for each
+    #  zone & county it covers) and 'zone_counties' (ST_ZONE: ST_CNTY)
+    def build():
+        zones_counties = pd.read_csv(ZONE_FILE, dtype=str, sep = '|', header = None)
+
+        # Keep the zone & county fips columns
+        zones_counties = zones_counties[[4, 6]].copy()
+        zones_counties.columns = ['ST_ZONE', 'CNTY_FIPS']
+
+        # Concatenate state abbreviation & county fips
+        zones_counties['ST_CNTY'] = zones_counties.ST_ZONE.str[:2] + zones_counties.CNTY_FIPS.str[-3:]
+
+        # Drop all records not in a coastal county
+        counties = coastal_locations()['counties']
+        zones_counties = zones_counties[zones_counties.CNTY_FIPS.isin(counties)].copy()
+        return {'zones': zones_counties,
+                'zone_counties': dict(zip(zones_counties['ST_ZONE'], zones_counties['ST_CNTY']))}
+    return cached_reference('forecast_zones', [ZONE_FILE, COASTAL_FILE], build)
+
+def census_states():
+    # A function that returns the state fips: abbreviation lookup of the state/zone file
+    #  used with the census data (first fips listed for each state)
+    def build():
+        st_fips = pd.read_csv(STATE_ZONE_FILE)[['STATE', 'FIPS']]
+        st_fips = st_fips[~st_fips.STATE.duplicated(keep = 'first')]
+        return dict(zip(st_fips['FIPS'] // 1000, st_fips['STATE']))
+    return cached_reference('state_zone', [STATE_ZONE_FILE], build)
+
+def build_point_index(x, y, node_size=INDEX_NODE_SIZE):
+    # A function that builds a spatial index (a shapely STRtree) over point coordinates.
+    #  Returns a dict with the tree & the arrays it is built from: 'rows' giving each
+    #  point's row in the input, its 'x' & 'y' & the tree's node size. Points without
+    #  coordinates are left out
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    rows = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    return build_point_index_from(rows, x[rows], y[rows], node_size)
+
+def point_index_path(path):
+    # A function that returns the file the spatial index of a table is kept in
+    return path + '.sindex.npz'
+
+def save_point_index(index, path):
+    # A function that writes the spatial index of the table at path (no extension). Only
+    #  the coordinate arrays are stored, the tree is rebuilt from them on load
+    file = point_index_path(path)
+    with open(file + '.tmp', 'wb') as out:
+        np.savez(out, **{name: index[name] for name in ['rows', 'x', 'y', 'node_size']})
+    os.replace(file + '.tmp', file)
+    return
+
+def load_point_index(path):
+    # A function that reads the spatial index of the table at path (no extension)
+    with np.load(point_index_path(path)) as index:
+        return build_point_index_from(index['rows'], index['x'], index['y'], int(index['node_size']))
+
+def build_point_index_from(rows, x, y, node_size=INDEX_NODE_SIZE):
+    # A function that rebuilds a spatial index from its stored arrays
+    index = {'rows': rows, 'x': x, 'y': y, 'node_size': np.int64(node_size)}
+    index['tree'] = shapely.STRtree(shapely.points(x, y), node_capacity=node_size)
+    return index
+
+def great_circle_km(lon1, lat1, lon2, lat2):
+    # A function that returns the haversine (great circle) distance in km between points
+    #  given in degrees
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def index_candidates(index, minx, miny, maxx, maxy):
+    # A function that returns the positions (in the index's arrays) of the points inside
+    #  a bounding box
+    return np.sort(index['tree'].query(shapely.box(minx, miny, maxx, maxy)))
+
+def query_bbox(index, minx, miny, maxx, maxy):
+    # A function that returns the table rows of the points inside a bounding box
+    return index['rows'][index_candidates(index, minx, miny, maxx, maxy)]
+
+def radius_candidates(index, lon, lat, radius_km):
+    # A function that returns the positions of the points within radius_km (great circle
+    #  distance) of a longitude & latitude, & their distances
+    dlat = np.degrees(radius_km / EARTH_RADIUS_KM)
+    edge = np.radians(min(90.0, abs(lat) + dlat))
+    dlon = 180.0 if np.cos(edge) < 1e-9 else min(180.0, dlat / np.cos(edge))
+    positions = index_candidates(index, lon - dlon, lat - dlat, lon + dlon, lat + dlat)
+    distance = great_circle_km(lon, lat, index['x'][positions], index['y'][positions])
+    within = distance <= radius_km
+    return positions[within], distance[within]
+
+def query_radius(index, lon, lat, radius_km):
+    # A function that returns the table rows of the points within radius_km (great circle
+    #  distance) of a longitude & latitude
+    return index['rows'][radius_candidates(index, lon, lat, radius_km)[0]]
+
+def query_polygon(index, polygon):
+    # A function that returns the table rows of the points inside (or on the edge of) a
+    #  shapely polygon or multipolygon, e.g. a storm surge area
+    return index['rows'][np.sort(index['tree'].query(polygon, predicate='intersects'))]
+
+def query_nearest(index, lon, lat):
+    # A function that returns the table row of the point nearest (great circle distance)
+    #  to a longitude & latitude & its distance in km (-1 & NaN for an empty index). The
+    #  tree finds the nearest point in degrees, then every point no farther than it is
+    #  checked so the result holds away from the equator too
+    if not index['rows'].size:
+        return -1, np.nan
+    nearest = index['tree'].query_nearest(shapely.Point(lon, lat))[0]
+    radius_km = great_circle_km(lon, lat, index['x'][nearest], index['y'][nearest])
+    positions, distance = radius_candidates(index, lon, lat, radius_km * (1 + 1e-9))
+    closest = np.lexsort((positions, distance))[0]
+    return int(index['rows'][positions[closest]]), float(distance[closest])
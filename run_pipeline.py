@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Runs the numbered stage scripts as a dependency graph. Stages on independent
+#  branches (NBI: 010 > 030 > 020 & 040, weather: 050 > 060, census: 070, and the
+#  optional county check 010 > 015) run at the same time, stages whose manifest
+#  shows nothing has changed are skipped, and the run stops with a non-zero exit
+#  code as soon as any stage fails.
+#
+# Usage: python run_pipeline.py [--jobs N] [--force] [--only 020 030 ...]
+
+import os
+import sys
+import glob
+import time
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import mwlib as mw
+
+
+# Output directories the stages write to
+OUTPUT_DIRS = ['output',
+               'output/census',
+               'output/county_check',
+               'output/county_groups',
+               'output/logs',
+               'output/nbi_clean',
+               'output/processed_weather',
+               'output/reference',
+               'output/shape_files',
+               'output/structure_age',
+               'output/time_series'
+              ]
+
+def tables(pattern):
+    # Table files matching a name pattern in the configured table format
+    return lambda: sorted(glob.glob(pattern + mw.TABLE_EXTS[mw.TABLE_FORMAT]))
+
+def files(*paths):
+    # A fixed list of files, with tables given without an extension
+    return lambda: [path if os.path.splitext(path)[1] else mw.table_path(path) for path in paths]
+
+def spatial(*paths):
+    # GIS outputs given without an extension, in the configured spatial format
+    return lambda: [mw.spatial_path(path) for path in paths]
+
+def cube(path):
+    # The files of a bridge cube given without an extension
+    return lambda: mw.cube_files(path)
+
+def all_of(*getters):
+    return lambda: [path for getter in getters for path in getter()]
+
+# Each stage: script, stages it depends on, and the inputs & outputs it records in its
+#  manifest. 010 tracks each year separately so it always runs & skips years itself
+STAGES = {
+    '010': {'script': '010_nbi_cleaning_v10.py',
+            'deps': [],
+            'inputs': None,
+            'outputs': None},
+    '015': {'script': '015_county_check_v01.py',
+            'deps': ['010'],
+            'inputs': all_of(tables('output/nbi_clean/out*'),
+                             files(os.environ.get('CB_COUNTY_BOUNDARIES', 'input/cb_us_county_500k.shp'))),
+            'outputs': files('output/county_check/county_mismatches',
+                             'output/county_check/county_check_summary')},
+    '030': {'script': '030_time_series_v12.py',
+            'deps': ['010'],
+            'inputs': tables('output/nbi_clean/out*'),
+            'outputs': all_of(tables('output/time_series/*_time_series'),
+                              cube('output/time_series/bridge_cube'))},
+    '020': {'script': '020_structure_age_v03.py',
+            'deps': ['010', '030'],
+            'inputs': cube('output/time_series/bridge_cube'),
+            'outputs': all_of(files('output/structure_age/structure_ages',
+                                    'output/structure_age/ages_by_county'),
+                              spatial('output/shape_files/bridge_ages'))},
+    '040': {'script': '040_county_avg_rating_v01.py',
+            'deps': ['030'],
+            'inputs': cube('output/time_series/bridge_cube'),
+            'outputs': files('output/county_groups/avg_county_rating')},
+    '045': {'script': '045_bridge_trends_v01.py',
+            'deps': ['030'],
+            'inputs': cube('output/time_series/bridge_cube'),
+            'outputs': files('output/time_series/bridge_trends',
+                             'output/county_groups/county_bridge_trends')},
+    '050': {'script': '050_weather_cleaning_v06.py',
+            'deps': [],
+            'inputs': all_of(lambda: sorted(glob.glob('input/noaa_data/*.csv')),
+                             files('input/Coastal_Counties.csv', 'input/bp05mr24.dbx')),
+            'outputs': files('output/processed_weather/total_counts')},
+    '060': {'script': '060_weather_frequency_cnty_v02.py',
+            'deps': ['050'],
+            'inputs': files('output/processed_weather/total_counts',
+                            'input/Coastal_Counties.csv', 'input/bp05mr24.dbx'),
+            'outputs': files('output/processed_weather/cnty_storm_history')},
+    '070': {'script': '070_census_v03.py',
+            'deps': [],
+            'inputs': all_of(lambda: sorted(glob.glob('input/census/*.csv')),
+                             files('input/state_zone.csv', 'input/Coastal_Counties.csv')),
+            'outputs': files('output/census/population_by_county')},
+    '100': {'script': '100_all_cnty_data_v03.py',
+            'deps': ['020', '040', '060', '070'],
+            'inputs': files('output/structure_age/ages_by_county',
+                            'output/processed_weather/cnty_storm_history',
+                            'output/county_groups/avg_county_rating',
+                            'output/census/population_by_county'),
+            'outputs': files('output/all_county_data.csv')},
+}
+
+
+def is_up_to_date(name):
+    # A function that checks a stage's manifest before starting a Python process for it.
+    #  If the declared inputs don't match what the stage records, the stage simply runs
+    #  and makes the decision itself
+    stage = STAGES[name]
+    if stage['inputs'] is None:
+        return False
+    return mw.stage_is_current(name, stage['inputs'](), stage['outputs'](), stage['script'])
+
+def run_stage(name, running):
+    # A function that runs one stage script, writing its output to output/logs/<stage>.log.
+    #  Returns the exit code & wall time
+    start = time.perf_counter()
+    if is_up_to_date(name):
+        return 'skipped', time.perf_counter() - start
+    with open('output/logs/' + name + '.log', 'w') as log:
+        process = subprocess.Popen([sys.executable, STAGES[name]['script']],
+                                   stdout=log, stderr=subprocess.STDOUT)
+        running[name] = process
+        returncode = process.wait()
+        del running[name]
+    return returncode, time.perf_counter() - start
+
+def run_pipeline(selected, jobs):
+    # A function that runs the selected stages (and nothing else) in dependency order,
+    #  with up to `jobs` stages at once. Returns the run times of each stage
+    for directory in OUTPUT_DIRS:
+        os.makedirs(directory, exist_ok = True)
+
+    pending = [name for name in STAGES if name in selected]
+    done = set(name for name in STAGES if name not in selected)
+    running = {}
+    timings = {}
+    failed = None
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {}
+        while pending or futures:
+            # Start every stage whose dependencies have all finished
+            if failed is None:
+                for name in [n for n in pending if all(d in done for d in STAGES[n]['deps'])]:
+                    pending.remove(name)
+                    futures[pool.submit(run_stage, name, running)] = name
+                    print('started  %s' % name, flush=True)
+            if not futures:
+                break
+
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = futures.pop(future)
+                result, seconds = future.result()
+                timings[name] = (result, seconds)
+                if result == 'skipped':
+                    print('skipped  %s (up to date)' % name, flush=True)
+                    done.add(name)
+                elif result == 0:
+                    print('finished %s in %.1f s' % (name, seconds), flush=True)
+                    done.add(name)
+                elif failed is None:
+                    failed = name
+                    print('FAILED   %s (exit code %s), see output/logs/%s.log' % (name, result, name),
+                          flush=True)
+                    # Stop stages that are still running
+                    for process in list(running.values()):
+                        process.terminate()
+    return timings, failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the coastal bridge pipeline')
+    parser.add_argument('--jobs', type=int, default=3, help='stages to run at the same time')
+    parser.add_argument('--force', action='store_true', help='rebuild everything (sets CB_FORCE=1)')
+    parser.add_argument('--only', nargs='+', default=list(STAGES), choices=list(STAGES),
+                        help='stages to run')
+    args = parser.parse_args()
+
+    if args.force:
+        os.environ['CB_FORCE'] = '1'
+        mw.FORCE = True
+
+    start = time.perf_counter()
+    timings, failed = run_pipeline(args.only, args.jobs)
+
+    # Summary of where the run spent its time
+    print('\nStage wall times:')
+    for name in STAGES:
+        if name in timings:
+            result, seconds = timings[name]
+            if result == 'skipped' or result == 0:
+                status = 'skipped' if result == 'skipped' else 'ok'
+            else:
+                status = 'failed' if name == failed else 'stopped'
+            print('\t%s  %-34s %8.1f s  %s' % (name, STAGES[name]['script'], seconds, status))
+    print('\ttotal %44.1f s' % (time.perf_counter() - start))
+
+    # Slowest steps of the stages that ran (from output/logs/<stage>_timings.csv)
+    mw.timing_report([name for name in STAGES if name in timings and timings[name][0] == 0])
+
+    if failed is not None:
+        with open('output/logs/' + failed + '.log') as log:
+            print('\nLast lines of the %s log:' % failed)
+            print(''.join(log.readlines()[-20:]))
+        sys.exit(1)